@@ -0,0 +1,140 @@
+import random
+import sys
+
+# Aggregated non-deletion proof over rounds i..j, from r_{i-1} to r_j.
+#
+# Rounds i..j only change nodes on the paths of their batches, so the siblings of the
+# union of the batches are the same at every root r_{i-1}..r_j. Every such sibling is
+# also a sibling of the round which touched its neighbour, thus its value is found in
+# that round's proof. The aggregated proof is
+#   (r_{i-1}, [r_i..r_j], [B_i..B_j], shared siblings of the union)
+#
+# The verifier computes the hash forest once with all batch leaves empty, and then
+# fills in the batches round by round, rehashing only the paths of that round.
+
+
+def sibling_paths(paths):
+    # siblings of all nodes on the given leaf paths, which are not on the paths themselves
+    affected = {p[:n] for p in paths for n in range(len(p) + 1)}
+    return {p[:-1] + ('1' if p[-1] == '0' else '0') for p in affected if p} - affected
+
+
+class RoundLog:
+    def __init__(self, smt):
+        self.smt = smt
+        self.rounds = []    # round n is at self.rounds[n-1]
+
+    def batch_insert(self, keys, values):
+        old_root = self.smt.get_root()
+        proof = self.smt.batch_insert(keys, values)
+        self.rounds.append({'old_root': old_root, 'new_root': self.smt.get_root(),
+                            'keys': list(keys), 'values': list(values), 'proof': proof})
+        return proof
+
+    def aggregate(self, i, j):
+        if not 1 <= i <= j <= len(self.rounds):
+            raise ValueError(f"Rounds {i}..{j} out of range 1..{len(self.rounds)}")
+        rounds = self.rounds[i-1:j]
+        keys = [key for r in rounds for key in r['keys']]
+        siblings = sibling_paths([self.smt.key_to_bits(key) for key in keys])
+        proof = {}
+        for r in rounds:
+            for k, v in r['proof'].items():
+                if k in siblings:
+                    proof[k] = v
+        return {'old_root': rounds[0]['old_root'],
+                'roots': [r['new_root'] for r in rounds],
+                'batches': [[r['keys'], r['values']] for r in rounds],
+                'proof': proof}
+
+
+def collapse(agg):
+    # the aggregated proof is a plain non-deletion proof from r_{i-1} to r_j for the
+    # union batch, to be proven in a single run by the existing verifiers and circuits
+    keys = [key for ks, _ in agg['batches'] for key in ks]
+    values = [value for _, vs in agg['batches'] for value in vs]
+    return agg['proof'], agg['old_root'], agg['roots'][-1], keys, values
+
+
+def verify_aggregated(smt, agg):
+    # smt provides the depth, the hash backend and the key encoding only
+    depth = smt.depth
+    batches = agg['batches']
+    if len(batches) != len(agg['roots']) or not batches:
+        print("Aggregated proof length mismatch", file=sys.stderr)
+        return False
+
+    paths = [[smt.key_to_bits(key) for key in ks] for ks, _ in batches]
+    union = [p for ps in paths for p in ps]
+    if len(set(union)) != len(union):
+        print("Aggregated proof batches overlap", file=sys.stderr)
+        return False
+
+    # forest: leaves of all batches are empty, siblings of the union come from the proof
+    # (the verifier decides the positions, surplus proof entries are never read)
+    nodes = {p: smt.default[0] for p in union}
+    for k in sibling_paths(union):
+        nodes[k] = agg['proof'].get(k, smt.default[depth - len(k)])
+
+    def rehash(leaves):
+        # recompute parents of the given leaf paths, reusing all other stored nodes
+        current = set(leaves)
+        for length in reversed(range(depth)):
+            parents = {p[:-1] for p in current}
+            level = depth - length - 1
+            for parent in parents:
+                left = nodes.get(parent + '0', smt.default[level])
+                right = nodes.get(parent + '1', smt.default[level])
+                nodes[parent] = smt.hash(left, right)
+            current = parents
+        return smt.backend.root(nodes[''])
+
+    r = rehash(union)
+    if r != agg['old_root']:
+        print(f"Aggregated proof root mismatch: r:{r}, oldr:{agg['old_root']}", file=sys.stderr)
+        return False
+
+    for n, ((_, values), ps, root) in enumerate(zip(batches, paths, agg['roots'])):
+        if len(values) != len(ps):
+            print(f"Aggregated proof batch {n} length mismatch", file=sys.stderr)
+            return False
+        for p, value in zip(ps, values):
+            nodes[p] = value
+        r = rehash(ps)
+        if r != root:
+            print(f"Aggregated proof root mismatch in round {n}: r:{r}, root:{root}", file=sys.stderr)
+            return False
+
+    # leaves were empty at r_{i-1}, and every round changed only its own leaves; the
+    # shared siblings stayed the same, thus nothing was overwritten in any round
+    return True
+
+
+def main():
+    from ndsmt import SparseMerkleTree
+
+    depth = 32
+    smt = SparseMerkleTree(depth, 'blake2s')
+    log = RoundLog(smt)
+    for _ in range(5):
+        keys = [k for k in set(random.sample(range(2**depth), 30)) if not smt.has_leaf(k)]
+        log.batch_insert(keys, [k + 1 for k in keys])
+
+    agg = log.aggregate(2, 4)
+    assert verify_aggregated(smt, agg)
+    assert smt.verify_non_deletion(*collapse(agg))
+    assert verify_aggregated(smt, log.aggregate(1, 5))
+
+    # tampered: a value, an intermediate root, a shared sibling, and a key inserted twice
+    (k0, v0), (k1, v1), (k2, v2) = agg['batches']
+    assert not verify_aggregated(smt, {**agg, 'batches': [[k0, v0], [k1, [v1[0] + 1] + v1[1:]], [k2, v2]]})
+    assert not verify_aggregated(smt, {**agg, 'roots': [agg['roots'][0]] * 3})
+    k = next(iter(agg['proof']))
+    assert not verify_aggregated(smt, {**agg, 'proof': {**agg['proof'], k: agg['proof'][k] + 1}})
+    old = log.rounds[0]['keys'][0]     # set in round 1, before the aggregated rounds
+    assert not verify_aggregated(smt, {**agg, 'batches': [[k0, v0], [[old] + k1, [old + 1] + v1], [k2, v2]]})
+    print("okay")
+
+
+if __name__ == "__main__":
+    main()
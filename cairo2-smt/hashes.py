@@ -0,0 +1 @@
+../hashes.py
\ No newline at end of file
@@ -0,0 +1 @@
+../keyfilter.py
\ No newline at end of file
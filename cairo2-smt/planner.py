@@ -0,0 +1 @@
+../planner.py
\ No newline at end of file
@@ -1,3 +1,4 @@
+import argparse
 import json
 import subprocess
 import tempfile
@@ -26,19 +27,29 @@ def to_cairo_serde(fn):
         cairo_args_list.append(to_hex(key))
         cairo_args_list.append(to_hex(value))
 
-    # proof: Array<Array<(u32, felt252)>>
-    cairo_args_list.append(to_hex(len(data["proof"]))) # Length of proof (outer array)
-    for inner_proof_array in data["proof"]:
-        cairo_args_list.append(to_hex(len(inner_proof_array))) # Length of inner array
-        for key, value in inner_proof_array:
-            cairo_args_list.append(to_hex(key))
-            cairo_args_list.append(to_hex(value))
+    if data.get("format") == "positional":
+        # mask: Array<u128>, values: Array<felt252>
+        for name in ("mask", "values"):
+            cairo_args_list.append(to_hex(len(data["proof"][name])))
+            cairo_args_list += [to_hex(v) for v in data["proof"][name]]
+    else:
+        # proof: Array<Array<(u32, felt252)>>
+        cairo_args_list.append(to_hex(len(data["proof"]))) # Length of proof (outer array)
+        for inner_proof_array in data["proof"]:
+            cairo_args_list.append(to_hex(len(inner_proof_array))) # Length of inner array
+            for key, value in inner_proof_array:
+                cairo_args_list.append(to_hex(key))
+                cairo_args_list.append(to_hex(value))
 
     # depth: u32
     cairo_args_list.append(to_hex(data["depth"]))
 
     return cairo_args_list
 
+def executable_name(fn):
+    with open(fn) as f:
+        return "main_positional" if json.load(f).get("format") == "positional" else "main"
+
 def run_command(command, description):
     print(f"\n--- {description} ---")
     print(f"Running command: {' '.join(command)}")
@@ -58,8 +69,16 @@ def run_command(command, description):
     return result
 
 def main():
+    parser = argparse.ArgumentParser(description="Build, execute, prove and verify the Cairo verifier")
+    parser.add_argument('input', nargs='?', default='input.json')
+    parser.add_argument('--serde', help="only convert the input to cairo serde arguments, written to this file")
+    args = parser.parse_args()
 
-    cairo_args = to_cairo_serde('input.json')
+    cairo_args = to_cairo_serde(args.input)
+    if args.serde:
+        with open(args.serde, 'w') as f:
+            json.dump(cairo_args, f)
+        return
 
     # Write the cairo serde format input to a temp file
     with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.json') as temp_arg_file:
@@ -76,6 +95,7 @@ def main():
         "--no-build",
         "--target", "standalone",
         "--package", "zk_verifier",
+        "--executable-name", executable_name(args.input),
         "--print-resource-usage",
         "--arguments-file", temp_arg_file_path,
     ], "Executing Cairo program to generate trace")
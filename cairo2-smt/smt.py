@@ -1,34 +1,24 @@
-from poseidon_py.poseidon_hash import poseidon_perm
+from planner import plan_batch
+from hashes import get_backend, default  # default 'empty' leaf
+import argparse
 import json
 import sys
 
-# Cairo's hardcoded Poseidon parameters:
-# https://github.com/starkware-industries/poseidon/blob/main/poseidon3.txt
-# and P = 2**251 + 17 * 2**192 + 1
-
-default = 0  # default 'empty' leaf
-
-def hash2(left, right):
-    # The following assumes that leaf's address/key/hash is bound to leaf's value
-    if left == default:
-        return right
-    elif right == default:
-        return left
-    else:
-        return poseidon_perm(left, right, 2)[0]
+# Cairo's Poseidon, with h(0, x) = x and h(x, 0) = x; see hashes.py for the parameters
+hash2 = get_backend('poseidon-stark').hash
 
 class SparseMerkleTree:
-    def __init__(self, depth=256):
+    def __init__(self, depth=256, backend='poseidon-stark'):
+        # backend: see hashes.py, only Poseidon Stark matches the Cairo verifier
         self.depth = depth
         # Node dictionary stores (level, key_integer) -> value
         self.nodes = {}
-        self.default = [default] * (depth + 1)
-        # Precompute default hashes for each level
-        for i in range(1, depth + 1):
-            self.default[i] = hash2(self.default[i-1], self.default[i-1])
+        self.backend = get_backend(backend)
+        self.hash = self.backend.hash
+        self.default = self.backend.default_table(depth)
 
     def get_root(self):
-        return self.get_node(self.depth, 0)
+        return self.backend.root(self.get_node(self.depth, 0))
 
     def get_node(self, level, key):
         """Gets a node's value. key is an integer."""
@@ -59,100 +49,137 @@ class SparseMerkleTree:
         new_nodes.sort()
         new_keys = [k for k, _ in new_nodes]
 
+        # Nodes on the paths of the inserted leaves, and the siblings needed for the proof:
+        # if one child is affected and the other is not, the unaffected one is a sibling
+        plan = plan_batch(new_keys, self.depth)
+        return self.insert_planned(new_nodes, plan.siblings, plan.nodes)
+
+    def open_round(self, keyfilter=None):
+        # batch_insert with the paths planned key by key, see OpenRound
+        return OpenRound(self, keyfilter)
+
+    def insert_planned(self, new_nodes, siblings, nodes):
+        # new_nodes: sorted (key, value) leaves not in the tree; siblings[level]: proof
+        # positions, nodes[level]: ancestors of the leaves at level
         # Insert all new leaves at level 0
         for node in new_nodes:
             self.update_node(0, node)
 
         proof = [[] for _ in range(self.depth)]  # proof[level] = [(key, value), ...]
 
-        # 'affected_keys_at_level' are the keys of nodes at a given level
-        # that are on the path of the inserted leaves.
-        affected_keys_at_level = set(new_keys)
-
         for level in range(self.depth):  # Iterate from leaves (level 0) up to root
-            parent_keys = {k >> 1 for k in affected_keys_at_level}
-
-            # For each parent, find the required siblings at the current level
-            for p_key in parent_keys:
-                left_child_key = p_key << 1
-                right_child_key = left_child_key | 1
-
-                is_left_affected = left_child_key in affected_keys_at_level
-                is_right_affected = right_child_key in affected_keys_at_level
-
-                # If one child is affected and the other is not, the unaffected one is a
-                # sibling needed for the proof.
-                if is_left_affected and not is_right_affected:
-                    sibling_val = self.get_node(level, right_child_key)
-                    if sibling_val != self.default[level]:
-                        proof[level].append((right_child_key, sibling_val))
-
-                if is_right_affected and not is_left_affected:
-                    sibling_val = self.get_node(level, left_child_key)
-                    if sibling_val != self.default[level]:
-                        proof[level].append((left_child_key, sibling_val))
+            for sibling_key in siblings[level]:
+                sibling_val = self.get_node(level, sibling_key)
+                if sibling_val != self.default[level]:
+                    proof[level].append((sibling_key, sibling_val))
 
             # Calculate and update the parent nodes in the tree
-            for p_key in parent_keys:
+            for p_key in nodes[level + 1]:
                 left_child_key = p_key << 1
                 right_child_key = left_child_key | 1
 
                 left_val = self.get_node(level, left_child_key)
                 right_val = self.get_node(level, right_child_key)
 
-                p_val = hash2(left_val, right_val)
+                p_val = self.hash(left_val, right_val)
                 self.update_node(level + 1, (p_key, p_val))
 
-            # The affected keys for the next level are the parent keys we just processed
-            affected_keys_at_level = parent_keys
-
         # Sort the proof lists for deterministic output
         for level_proof in proof:
             level_proof.sort()
 
         return proof
 
-def verify_non_deletion(proof, old_root, new_root, batch, depth):
+
+class OpenRound:
+    # A batch collected key by key while the round is open. Every admit() adds the
+    # new ancestors of the key and updates the proof positions per level: siblings of
+    # ancestors which are not ancestors themselves. close() then only hashes the
+    # paths and reads the siblings, its cost does not depend on how long the round was
+    # open. The proof is the same as batch_insert(batch), for the sorted batch.
+    # With a KeyFilter over the committed keys (../keyfilter.py), admit() asks the
+    # filter instead of the node store, and close() adds the batch to the filter.
+    def __init__(self, smt, keyfilter=None):
+        self.smt = smt
+        self.keyfilter = keyfilter
+        self.batch = []         # (key, value) in admission order, sorted on close
+        self.keys = set()
+        self.nodes = [set() for _ in range(smt.depth + 1)]
+        self.siblings = [set() for _ in range(smt.depth)]
+
+    def admit(self, key, value):
+        committed = not self.keyfilter.admit(key) if self.keyfilter else (0, key) in self.smt.nodes
+        if key in self.keys or committed:
+            print(f"The leaf '{key}' is already set, skipping.", file=sys.stderr)
+            return False
+        self.keys.add(key)
+        self.batch.append((key, value))
+        for level in range(self.smt.depth):
+            x = key >> level
+            if x in self.nodes[level]:
+                break
+            self.nodes[level].add(x)
+            self.siblings[level].discard(x)
+            if x ^ 1 not in self.nodes[level]:
+                self.siblings[level].add(x ^ 1)
+        self.nodes[self.smt.depth].add(0)
+        return True
+
+    def close(self):
+        for key in self.keys:
+            if (0, key) in self.smt.nodes:
+                raise ValueError(f"The leaf '{key}' was set while the round was open")
+        self.batch.sort()
+        proof = self.smt.insert_planned(self.batch, self.siblings, self.nodes)
+        if self.keyfilter:
+            self.keyfilter.commit(self.keys)
+        return proof
+
+
+def compute_forest(proof, nodes, depth, backend='poseidon-stark'):
     # computing from leaves towards root. This is also important for security: we show that based on leaves
     # we reach a specific root, and intermediate hashes from the proof must not override the chains.
-    def compute_forest(nodes):
-        for level in range(depth):
-            next_nodes = []
-            lproof = proof[level]
-            i, j = 0, 0
-            while i < len(nodes):
-                k, kval = nodes[i]
-                parent = k // 2             # unsigned_div_rem()
-                last_bit = k % 2
-                sibling = parent * 2 + (1 - last_bit) # zk friendlier than bitwise
-                if last_bit == 0 and i != len(nodes)-1 and nodes[i+1][0] == sibling:
-                    i = i + 1
-                    siblingval = nodes[i][1]
-                elif j < len(lproof) and lproof[j][0] == sibling:
-                    siblingval = lproof[j][1]
-                    j = j + 1
-                else:
-                    siblingval = default
-
-                pv = hash2(kval, siblingval) if last_bit == 0 else hash2(siblingval, kval)
-                next_nodes.append((parent, pv))
+    backend = get_backend(backend)
+    hash2 = backend.hash
+    for level in range(depth):
+        next_nodes = []
+        lproof = proof[level]
+        i, j = 0, 0
+        while i < len(nodes):
+            k, kval = nodes[i]
+            parent = k // 2             # unsigned_div_rem()
+            last_bit = k % 2
+            sibling = parent * 2 + (1 - last_bit) # zk friendlier than bitwise
+            if last_bit == 0 and i != len(nodes)-1 and nodes[i+1][0] == sibling:
                 i = i + 1
-            nodes = next_nodes
-        assert len(nodes) == 1  # 1 node at the root level
-        return nodes[0][1]
+                siblingval = nodes[i][1]
+            elif j < len(lproof) and lproof[j][0] == sibling:
+                siblingval = lproof[j][1]
+                j = j + 1
+            else:
+                siblingval = default
 
+            pv = hash2(kval, siblingval) if last_bit == 0 else hash2(siblingval, kval)
+            next_nodes.append((parent, pv))
+            i = i + 1
+        nodes = next_nodes
+    assert len(nodes) == 1  # 1 node at the root level
+    return backend.root(nodes[0][1])
+
+
+def verify_non_deletion(proof, old_root, new_root, batch, depth, backend='poseidon-stark'):
     if not batch:
         return old_root == new_root
 
     # step 1. compute old root based on proof and 'empty' leaves in place of new batch
     p1 = [(key, default) for key, _ in batch]  # empty leaves
-    r1 = compute_forest(p1)
+    r1 = compute_forest(proof, p1, depth, backend)
     if r1 != old_root:
         print(f"Non-deletion proof root 1 mismatch: r:{r1}, oldr:{old_root}", file=sys.stderr)
         return False
 
     # step 2. compute new root based on proof and leaves from the batch
-    r2 = compute_forest(batch)
+    r2 = compute_forest(proof, batch, depth, backend)
     if r2 != new_root:
         print(f"Non-deletion proof root 2 mismatch: r:{r2}, newr:{new_root}", file=sys.stderr)
         return False
@@ -169,8 +196,152 @@ def verify_non_deletion(proof, old_root, new_root, batch, depth):
     return True
 
 
+# Positional (key-free) proof encoding. The verifier walks the same forest as
+# compute_forest; every node without its sibling in the forest (a lone node) takes
+# the next bit of the mask, in traversal order: level by level, left to right. A set
+# bit takes the sibling from the next of values, a clear bit means an empty sibling.
+# The positions follow from the batch keys, so keys are not sent; the mask costs one
+# bit per lone node, packed into 128-bit words (u128 in Cairo), least significant
+# bit first.
+MASK_BITS = 128
+
+def encode_positional(proof, batch, depth):
+    plan = plan_batch([k for k, _ in batch], depth)
+    bits, values = [], []
+    for level in range(depth):
+        lproof = dict(proof[level])
+        for sibling in plan.siblings[level]:
+            value = lproof.get(sibling, default)
+            bits.append(value != default)
+            if value != default:
+                values.append(value)
+    mask = [0] * ((len(bits) + MASK_BITS - 1) // MASK_BITS)
+    for n, bit in enumerate(bits):
+        if bit:
+            mask[n // MASK_BITS] |= 1 << (n % MASK_BITS)
+    return {"mask": mask, "values": values}
+
+
+def compute_forest_positional(proof, nodes, depth, backend='poseidon-stark'):
+    backend = get_backend(backend)
+    hash2 = backend.hash
+    mask, values = proof["mask"], proof["values"]
+    n, j = 0, 0
+    for level in range(depth):
+        next_nodes = []
+        i = 0
+        while i < len(nodes):
+            k, kval = nodes[i]
+            parent = k // 2
+            last_bit = k % 2
+            if last_bit == 0 and i != len(nodes)-1 and nodes[i+1][0] == k + 1:
+                i = i + 1
+                siblingval = nodes[i][1]
+            else:
+                siblingval = default
+                if mask[n // MASK_BITS] >> (n % MASK_BITS) & 1:
+                    siblingval = values[j]
+                    j = j + 1
+                n = n + 1
+
+            pv = hash2(kval, siblingval) if last_bit == 0 else hash2(siblingval, kval)
+            next_nodes.append((parent, pv))
+            i = i + 1
+        nodes = next_nodes
+    assert len(nodes) == 1  # 1 node at the root level
+    assert j == len(values) and len(mask) == (n + MASK_BITS - 1) // MASK_BITS  # all of the proof is used
+    assert not mask or mask[-1] >> ((n - 1) % MASK_BITS + 1) == 0
+    return backend.root(nodes[0][1])
+
+
+def verify_non_deletion_positional(proof, old_root, new_root, batch, depth, backend='poseidon-stark'):
+    # verify_non_deletion for a proof from encode_positional
+    if not batch:
+        return old_root == new_root
+
+    r1 = compute_forest_positional(proof, [(key, default) for key, _ in batch], depth, backend)
+    if r1 != old_root:
+        print(f"Non-deletion proof root 1 mismatch: r:{r1}, oldr:{old_root}", file=sys.stderr)
+        return False
+
+    r2 = compute_forest_positional(proof, batch, depth, backend)
+    if r2 != new_root:
+        print(f"Non-deletion proof root 2 mismatch: r:{r2}, newr:{new_root}", file=sys.stderr)
+        return False
+    return True
+
+
+def split_proof(proof, batch, depth, s, backend='poseidon-stark'):
+    # Splits a consistency proof by the top s bits of the batch keys into independent
+    # sub-proofs of depth (depth - s), one for every touched subtree, and the top-level
+    # proof above them. Sub-proofs are in the input.json format and are verified (and
+    # proven) like any other round; top lists the subtree roots before and after.
+    if not 0 < s < depth:
+        raise ValueError(f"Split {s} out of range 1..{depth - 1}")
+    sub_depth = depth - s
+    groups = {}
+    for key, value in batch:
+        groups.setdefault(key >> sub_depth, []).append((key & ((1 << sub_depth) - 1), value))
+
+    subs = []
+    for prefix in sorted(groups):
+        sub_batch = sorted(groups[prefix])
+        sub_proof = []
+        for level in range(sub_depth):
+            shift = sub_depth - level
+            sub_proof.append([(k & ((1 << shift) - 1), v) for k, v in proof[level] if k >> shift == prefix])
+        subs.append({
+            "prefix": prefix,
+            "old_root": compute_forest(sub_proof, [(k, default) for k, _ in sub_batch], sub_depth, backend),
+            "new_root": compute_forest(sub_proof, sub_batch, sub_depth, backend),
+            "batch": sub_batch,
+            "proof": sub_proof,
+            "depth": sub_depth,
+        })
+    top = {
+        "prefixes": [sub["prefix"] for sub in subs],
+        "old_roots": [sub["old_root"] for sub in subs],
+        "new_roots": [sub["new_root"] for sub in subs],
+        "proof": proof[sub_depth:],
+        "depth": s,
+    }
+    return top, subs
+
+
+def verify_partitioned(top, subs, old_root, new_root, depth, backend='poseidon-stark'):
+    # every sub-proof is a consistency proof between its subtree roots, and the top
+    # proof links the subtree roots to the tree roots, before and after the batch
+    s = top["depth"]
+    if not 0 < s < depth or len(top["proof"]) != s or [sub["prefix"] for sub in subs] != top["prefixes"] \
+            or top["prefixes"] != sorted(set(top["prefixes"])) or any(sub["depth"] != depth - s for sub in subs):
+        print("Partitioned proof: bad shape", file=sys.stderr)
+        return False
+    if not top["prefixes"]:
+        # empty batch, same as verify_non_deletion
+        return old_root == new_root
+    for sub, old, new in zip(subs, top["old_roots"], top["new_roots"]):
+        if not verify_non_deletion(sub["proof"], old, new, sub["batch"], sub["depth"], backend):
+            return False
+    for roots, root in ((top["old_roots"], old_root), (top["new_roots"], new_root)):
+        r = compute_forest(top["proof"], list(zip(top["prefixes"], roots)), s, backend)
+        if r != root:
+            print(f"Partitioned proof: top root mismatch: r:{r}, root:{root}", file=sys.stderr)
+            return False
+    return True
+
+
 def main():
-    depth = 32
+    parser = argparse.ArgumentParser(description="Generate input.json for the Cairo verifier")
+    parser.add_argument('--depth', type=int, default=32)
+    parser.add_argument('--fill', type=int, default=1000, help="leaves inserted before the proven batch")
+    parser.add_argument('--batch', type=int, default=1000, help="size of the proven batch")
+    parser.add_argument('--positional', action='store_true',
+                        help="key-free proof encoding, for the main_positional executable")
+    parser.add_argument('--split', type=int, default=0,
+                        help="partition the proof by the top SPLIT key bits; writes input_<prefix>.json for every "
+                             "touched subtree and top.json")
+    args = parser.parse_args()
+    depth = args.depth
 
     def to_int(aa):
         if isinstance(aa, (list, tuple)):
@@ -194,7 +365,7 @@ def main():
 
     # --- pre-filling the tree ---
     batch = []
-    for i in range(1000):
+    for i in range(args.fill):
         rk = hash("a" + str(i)) % (2**depth)
         rv = to_int("Val " + str(rk))
         if (rk, rv) in batch: continue
@@ -209,10 +380,10 @@ def main():
 
     # --- batch for proving ---
     batch = []
-    for i in range(1000):
+    for i in range(args.batch):
         rk = hash("b" + str(i)) % (2**depth)
         rv = to_int("Val " + str(rk))
-        if (rk, rv) in batch: continue
+        if (rk, rv) in batch or (0, rk) in smt.nodes: continue
         batch.append((rk, rv))
 
     batch = sorted(batch)
@@ -223,6 +394,17 @@ def main():
     new_root = smt.get_root()
     assert verify_non_deletion(proof, old_root, new_root, batch, depth)
 
+    if args.split:
+        top, subs = split_proof(proof, batch, depth, args.split)
+        assert verify_partitioned(top, subs, old_root, new_root, depth)
+        for sub in subs:
+            with open(f"input_{sub['prefix']}.json", 'w') as f:
+                json.dump({k: sub[k] for k in ("old_root", "new_root", "batch", "proof", "depth")}, f, indent=4)
+        with open("top.json", 'w') as f:
+            json.dump({**top, "old_root": old_root, "new_root": new_root}, f, indent=4)
+        print(f"Wrote {len(subs)} sub-proofs of depth {depth - args.split} and top.json.", file=sys.stderr)
+        return
+
     witness_data = {
         "old_root": old_root,
         "new_root": new_root,
@@ -230,6 +412,10 @@ def main():
         "proof": proof,
         "depth": depth
     }
+    if args.positional:
+        witness_data["proof"] = encode_positional(proof, batch, depth)
+        witness_data["format"] = "positional"
+        assert verify_non_deletion_positional(witness_data["proof"], old_root, new_root, batch, depth)
     print(json.dumps(witness_data, indent=4))
 
 
@@ -96,6 +96,102 @@ fn verify_non_deletion(
     true
 }
 
+// Positional (key-free) proof, see encode_positional in smt.py: every node without
+// its sibling in the forest takes the next bit of mask, in traversal order; a set bit
+// takes the sibling from the next of values, a clear bit means an empty sibling.
+const MASK_BITS: u32 = 128;
+
+fn compute_forest_positional(
+    mask: @Array<u128>,
+    values: @Array<felt252>,
+    initial_leaves: @Array<(u32, felt252)>,
+    depth: u32,
+) -> felt252 {
+    let mut current_nodes = initial_leaves.clone();
+    let mut bits: u128 = 0;
+    let mut n = 0; // lone nodes so far
+    let mut w = 0; // next mask word
+    let mut j = 0; // next value
+
+    let mut level = 0;
+    while level < depth {
+        let mut next_level_nodes: Array<(u32, felt252)> = ArrayTrait::new();
+
+        let mut i = 0;
+        let current_nodes_len = current_nodes.len();
+        while i < current_nodes_len {
+            let (k, kval) = *current_nodes.at(i);
+            let parent = k / 2;
+            let is_left_child = (k % 2) == 0;
+            let mut sibling_val: felt252 = DEFAULT_LEAF;
+
+            let mut sibling_found = false;
+            if is_left_child && i + 1 < current_nodes_len {
+                let (next_k, next_val) = *current_nodes.at(i + 1);
+                if next_k == k + 1 {
+                    sibling_val = next_val;
+                    i += 1; // Consume two nodes from current_nodes
+                    sibling_found = true;
+                }
+            }
+            if !sibling_found {
+                if n % MASK_BITS == 0 {
+                    bits = *mask.at(w);
+                    w += 1;
+                }
+                if bits % 2 == 1 {
+                    sibling_val = *values.at(j);
+                    j += 1; // Consume the proof value
+                }
+                bits = bits / 2;
+                n += 1;
+            }
+            let parent_val = if is_left_child {
+                hash2(kval, sibling_val)
+            } else {
+                hash2(sibling_val, kval)
+            };
+            next_level_nodes.append((parent, parent_val));
+            i += 1;
+        };
+        current_nodes = next_level_nodes;
+        level += 1;
+    };
+    assert(current_nodes.len() == 1, 'Expected 1 node at root');
+    assert(w == mask.len() && bits == 0, 'Unused proof mask');
+    assert(j == values.len(), 'Unused proof values');
+    let (_, root_val) = *current_nodes.at(0);
+    root_val
+}
+
+fn verify_non_deletion_positional(
+    mask: @Array<u128>,
+    values: @Array<felt252>,
+    old_root: felt252,
+    new_root: felt252,
+    batch: @Array<(u32, felt252)>,
+    depth: u32,
+) -> bool {
+    // Step 1: Compute old root based on proof and empty leaves
+    let mut p1: Array<(u32, felt252)> = ArrayTrait::new();
+    let batch_len = batch.len();
+    let mut k_idx = 0;
+    while k_idx < batch_len {
+        let (k, _) = *batch.at(k_idx);
+        p1.append((k, DEFAULT_LEAF));
+        k_idx += 1;
+    };
+
+    let r1 = compute_forest_positional(mask, values, @p1, depth);
+    assert(r1 == old_root, 'Root 1 mismatch');
+
+    // Step 2: Compute new root based on siblings from proof and inserted values
+    let r2 = compute_forest_positional(mask, values, batch, depth);
+    assert(r2 == new_root, 'Root 2 mismatch');
+
+    true
+}
+
 #[derive(Drop, Serde)]
 struct Args {
     old_root: felt252,
@@ -118,9 +214,31 @@ fn main(args: Args) {
     assert(result, 'Verification FAILED');
 }
 
+#[derive(Drop, Serde)]
+struct PositionalArgs {
+    old_root: felt252,
+    new_root: felt252,
+    batch: Array<(u32, felt252)>,
+    mask: Array<u128>,
+    values: Array<felt252>,
+    depth: u32,
+}
+
+#[executable]
+fn main_positional(args: PositionalArgs) {
+    let PositionalArgs { old_root, new_root, batch, mask, values, depth } = args;
+
+    // Sanity checks
+    assert(batch.len() > 0, 'Empty batch');
+    assert(depth > 0, 'Depth is zero');
+
+    let result = verify_non_deletion_positional(@mask, @values, old_root, new_root, @batch, depth);
+    assert(result, 'Verification FAILED');
+}
+
 #[cfg(test)]
 mod tests {
-    use super::{DEFAULT_LEAF, hash2, compute_forest, verify_non_deletion};
+    use super::{DEFAULT_LEAF, hash2, compute_forest, verify_non_deletion, compute_forest_positional};
     use core::array::ArrayTrait;
 
     // Helper to create a dummy proof for testing
@@ -208,4 +326,21 @@ mod tests {
         let h = hash2(100, 50);
         assert(root == h, 'compute_forest 1 leaf failed');
     }
-}
\ No newline at end of file
+
+    #[test]
+    fn test_compute_forest_positional_single_leaf() {
+        // same tree as test_compute_forest_single_leaf: level 0 sibling 50, level 1 empty
+        let depth = 2;
+        let mut initial_leaves: Array<(u32, felt252)> = ArrayTrait::new();
+        initial_leaves.append((0, 100));
+
+        let mut mask: Array<u128> = ArrayTrait::new();
+        mask.append(1);
+        let mut values: Array<felt252> = ArrayTrait::new();
+        values.append(50);
+
+        let root = compute_forest_positional(@mask, @values, @initial_leaves, depth);
+        let h = hash2(100, 50);
+        assert(root == h, 'positional 1 leaf failed');
+    }
+}
@@ -1,9 +1,115 @@
+import argparse
 import json
+import os
+import re
 import sys
-from smt import verify_non_deletion
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from smt import verify_non_deletion, verify_non_deletion_positional
 
-fn = sys.argv[1] if len(sys.argv) > 1 else 'input.json'
-with open(fn) as f:
-    d = json.load(f)
-    assert(verify_non_deletion(d['proof'], d['old_root'], d['new_root'], d['batch'], d['depth']))
-    print("okay")
+# Verifies a single round file, or a chain of rounds: a directory of round files
+# (in natural name order) or a stream of rounds, one JSON object per line on stdin.
+# Rounds are verified in parallel, results are checked in order: every round's
+# old_root must be the previous round's new_root. Stops at the first failure.
+
+# A malformed round is a failed round, (None, None, False), never an exception:
+# the chain reports it by name instead of dying in the pool.
+def verify(d):
+    try:
+        old_root, new_root = d['old_root'], d['new_root']
+        verifier = verify_non_deletion_positional if d.get('format') == 'positional' else verify_non_deletion
+        ok = verifier(d['proof'], old_root, new_root, d['batch'], d['depth'], d.get('hash', 'poseidon-stark'))
+    except (AssertionError, AttributeError, KeyError, IndexError, TypeError, ValueError) as e:
+        print(f"Malformed proof: {e!r}", file=sys.stderr)
+        return None, None, False
+    return old_root, new_root, ok
+
+def verify_line(line):
+    try:
+        d = json.loads(line)
+    except ValueError as e:
+        print(f"Malformed JSON: {e}", file=sys.stderr)
+        return None, None, False
+    return verify(d)
+
+def verify_file(fn):
+    try:
+        with open(fn) as f:
+            d = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Cannot read {fn}: {e}", file=sys.stderr)
+        return None, None, False
+    return verify(d)
+
+def natural(fn):
+    return [int(s) if s.isdigit() else s for s in re.split(r'(\d+)', fn)]
+
+def rounds(src):
+    # yields (name, work item) in round order
+    if src == '-':
+        for n, line in enumerate(sys.stdin):
+            if line.strip():
+                yield f"stdin:{n+1}", line
+    else:
+        for fn in sorted(os.listdir(src), key=natural):
+            if fn.endswith('.json'):
+                yield fn, os.path.join(src, fn)
+
+def verify_chain(src, workers):
+    job = verify_line if src == '-' else verify_file
+    window = 4 * (workers or os.cpu_count() or 1)
+    count = 0
+    prev_root = None
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        items = rounds(src)
+        while True:
+            # keep a bounded window of rounds in flight, consume in order
+            while len(pending) < window:
+                item = next(items, None)
+                if item is None:
+                    break
+                pending.append((item[0], pool.submit(job, item[1])))
+            if not pending:
+                break
+            name, future = pending.popleft()
+            try:
+                old_root, new_root, ok = future.result()
+            except Exception as e:
+                # e.g. a worker killed by the OS
+                print(f"Round {count+1} ({name}): {e!r}", file=sys.stderr)
+                old_root, new_root, ok = None, None, False
+            if ok and prev_root is not None and old_root != prev_root:
+                print(f"Round {count+1} ({name}): old_root does not match the previous new_root", file=sys.stderr)
+                ok = False
+            if not ok:
+                for _, f in pending:
+                    f.cancel()
+                print(f"Round {count+1} ({name}) FAILED")
+                return False
+            count += 1
+            prev_root = new_root
+            print(f"{name}: okay")
+    print(f"okay, {count} rounds")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify non-deletion proofs")
+    parser.add_argument('src', nargs='?', default='input.json',
+                        help="round file, directory of round files, or '-' for JSON lines on stdin")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args()
+
+    if args.src == '-' or os.path.isdir(args.src):
+        if not verify_chain(args.src, args.jobs):
+            exit(1)
+    else:
+        if not verify_file(args.src)[2]:
+            print("FAILED")
+            exit(1)
+        print("okay")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+pragma circom 2.0.6;
+
+// Templates of the non-deletion verifier, see ndproof.circom and ndproof_split.circom
+
+include "node_modules/circomlib/circuits/poseidon.circom";
+include "node_modules/circomlib/circuits/bitify.circom";
+include "node_modules/circomlib/circuits/multiplexer.circom";
+include "node_modules/circomlib/circuits/comparators.circom";
+
+// produces less constraints than Quin Selector
+template PickOne(N) {
+    signal input in[N];
+    signal input sel;
+    signal output out;
+
+    component mux = Multiplexer(1, N);
+    for (var i = 0; i < N; i++) {
+        mux.inp[i][0] <== in[i];
+    }
+    mux.sel <== sel;
+    out <== mux.out[0];
+}
+
+template Mux() {
+    signal input sel;
+    signal input in[2];
+    signal output out;
+    signal p;
+
+    p <== in[0] * (1 - sel);
+    out <== p + (in[1] * sel);
+}
+
+template Hash2() {
+    signal input L;
+    signal input R;
+    signal output out;
+
+    component isZeroL = IsZero();
+    isZeroL.in <== L;
+    component isZeroR = IsZero();
+    isZeroR.in <== R;
+    signal bothZero <== isZeroL.out * isZeroR.out;
+
+    component h = Poseidon(2);
+    h.inputs[0] <== L;
+    h.inputs[1] <== R;
+
+    component mux = Mux();
+    mux.sel <== bothZero;
+    mux.in[0] <== h.out;
+    mux.in[1] <== 0;
+    out <== mux.out;
+}
+
+// control signals are choosing inputs from the vectors:
+// leaf layer:
+// |  0 |  input batch       |   proof    |
+// following layers:
+// |  0 |  prev. layer outs  |   proof    |
+template Cell(N, M) {
+    signal input controlL;
+    signal input controlR;
+    signal input in[N];
+    signal input proof[M];
+    signal output out;
+
+    component muxL = PickOne(N+M+1);
+    component muxR = PickOne(N+M+1);
+    component hasher = Hash2();
+
+    // if there is no special hashing rule h(0,0)->0, then there are per-layer hardcoded constants
+    muxL.in[0] <== 0;
+    muxR.in[0] <== 0;
+
+    for (var i = 0; i < N; i++) {
+        muxL.in[i+1] <== in[i];
+        muxR.in[i+1] <== in[i];
+    }
+
+    for (var i = N; i < N+M; i++) {
+        muxL.in[i+1] <== proof[i-N];
+        muxR.in[i+1] <== proof[i-N];
+    }
+    muxL.sel <== controlL;
+    muxR.sel <== controlR;
+    hasher.L <== muxL.out;
+    hasher.R <== muxR.out;
+    out <== hasher.out;
+}
+
+// Proof split into NG segments of SEG elements: layer d (0 is the leaf layer) picks
+// from segment d % NG only, a narrower mux than over the whole proof. Layers are
+// interleaved, as proof elements concentrate near the root. Control wires index the
+// local segment:
+// |  0 |  prev. layer outs  |   proof[d % NG]    |
+// The unsplit NdVerifier(DEPTH, WIDTH, M) is the case NG = 1, SEG = M.
+template ForestHasherSplit(DEPTH, WIDTH, NG, SEG) {
+    signal input batch[WIDTH];
+    signal input proof[NG][SEG];
+    signal input controlL[DEPTH][WIDTH];
+    signal input controlR[DEPTH][WIDTH];
+    signal output root;
+
+    component cell[DEPTH][WIDTH];
+    signal intermediateRoots[DEPTH][WIDTH];
+
+    for (var d = 0; d < DEPTH; d++) {
+        var numCells = 1 << (DEPTH - 1 - d);
+        if (numCells > WIDTH) {
+            numCells = WIDTH;
+        }
+        for (var i = 0; i < numCells; i++) {
+            cell[d][i] = Cell(WIDTH, SEG);
+            cell[d][i].controlL <== controlL[DEPTH-d-1][i];  // flip layers of wires
+            cell[d][i].controlR <== controlR[DEPTH-d-1][i];
+            if (d == 0) {
+                cell[d][i].in <== batch;
+            } else {
+                var prevLayerCells = 1 << (DEPTH - d);
+                if (prevLayerCells > WIDTH) {
+                    prevLayerCells = WIDTH;
+                }
+                for (var j = 0; j < prevLayerCells; j++) {
+                    cell[d][i].in[j] <== intermediateRoots[d-1][j];
+                }
+                for (var j = prevLayerCells; j < WIDTH; j++) {
+                    cell[d][i].in[j] <== 0;
+                }
+            }
+            for (var j = 0; j < SEG; j++) {
+                cell[d][i].proof[j] <== proof[d % NG][j];
+            }
+            intermediateRoots[d][i] <== cell[d][i].out;
+        }
+    }
+
+    root <== intermediateRoots[DEPTH-1][0];
+}
+
+template NdVerifierSplit(DEPTH, WIDTH, NG, SEG) {
+    signal input batch[WIDTH];
+    signal input proof[NG][SEG];
+    signal input root1;
+    signal input root2;
+    signal input controlL[DEPTH][WIDTH];
+    signal input controlR[DEPTH][WIDTH];
+    signal result1;
+    signal result2;
+
+    component fh1 = ForestHasherSplit(DEPTH, WIDTH, NG, SEG);
+    for (var i = 0; i < WIDTH; i++) {
+        fh1.batch[i] <== 0;
+    }
+    for (var g = 0; g < NG; g++) {
+        for (var j = 0; j < SEG; j++) {
+            fh1.proof[g][j] <== proof[g][j];
+        }
+    }
+    for (var i = 0; i < DEPTH; i++) {
+        for (var j = 0; j < WIDTH; j++) {
+            fh1.controlL[i][j] <== controlL[i][j];
+            fh1.controlR[i][j] <== controlR[i][j];
+        }
+    }
+    result1 <== fh1.root;
+    result1 === root1;
+
+    component fh2 = ForestHasherSplit(DEPTH, WIDTH, NG, SEG);
+    fh2.batch <== batch;
+    for (var g = 0; g < NG; g++) {
+        for (var j = 0; j < SEG; j++) {
+            fh2.proof[g][j] <== proof[g][j];
+        }
+    }
+    for (var i = 0; i < DEPTH; i++) {
+        for (var j = 0; j < WIDTH; j++) {
+            fh2.controlL[i][j] <== controlL[i][j];
+            fh2.controlR[i][j] <== controlR[i][j];
+        }
+    }
+    result2 <== fh2.root;
+    result2 === root2;
+}
+
+// proof of M elements, every layer picks from all of it
+template NdVerifier(DEPTH, WIDTH, M) {
+    signal input batch[WIDTH];
+    signal input proof[M];
+    signal input root1;
+    signal input root2;
+    signal input controlL[DEPTH][WIDTH];
+    signal input controlR[DEPTH][WIDTH];
+
+    component v = NdVerifierSplit(DEPTH, WIDTH, 1, M);
+    v.batch <== batch;
+    for (var j = 0; j < M; j++) {
+        v.proof[0][j] <== proof[j];
+    }
+    v.root1 <== root1;
+    v.root2 <== root2;
+    for (var i = 0; i < DEPTH; i++) {
+        for (var j = 0; j < WIDTH; j++) {
+            v.controlL[i][j] <== controlL[i][j];
+            v.controlR[i][j] <== controlR[i][j];
+        }
+    }
+}
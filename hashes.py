@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+
+# Hash backends of the trees and verifiers.
+#
+# A backend is a 2-to-1 compression function together with its rule for empty nodes:
+#   'zero'         h(0, 0) = 0, so every empty subtree hashes to 0
+#   'passthrough'  h(0, x) = x and h(x, 0) = x, a lone node rises unchanged; assumes
+#                  that the leaf's key is bound to its value
+# Under both rules all empty subtrees hash to 0, which proofs rely on by omitting them.
+#
+# Only the Poseidon backends match the circuits (BN254 for ndproof.circom, Stark for
+# the Cairo verifier). The hashlib backends are for replicas, simulations and tests
+# that never feed a prover, and are much faster.
+#
+# Roots returned by the trees are tagged with the name of their backend, and tagged
+# roots of different backends never compare equal.
+
+default = 0  # default 'empty' leaf, for every backend
+
+
+class Root(int):
+    def __new__(cls, value, backend):
+        root = super().__new__(cls, value)
+        root.backend = backend
+        return root
+
+    def __getnewargs__(self):
+        return (int(self), self.backend)
+
+    def __eq__(self, other):
+        if isinstance(other, Root) and other.backend != self.backend:
+            return False
+        return int(self) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = int.__hash__
+
+
+class Backend:
+    def __init__(self, name, compress, empty):
+        self.name = name
+        self.empty = empty
+        self.compress = compress
+        if empty == 'zero':
+            self.hash = self.hash_zero
+        elif empty == 'passthrough':
+            self.hash = self.hash_passthrough
+        else:
+            raise ValueError(f"Unknown empty node rule '{empty}'")
+
+    def __reduce__(self):
+        # backends are singletons, trees pickle a reference to theirs
+        return get_backend, (self.name,)
+
+    def hash_zero(self, left, right):
+        if left == default and right == default:
+            return default
+        return self.compress(left, right)
+
+    def hash_passthrough(self, left, right):
+        if left == default:
+            return right
+        elif right == default:
+            return left
+        return self.compress(left, right)
+
+    def default_table(self, depth):
+        return default_table(self.name, depth, self.hash)
+
+    def root(self, value):
+        return Root(value, self.name)
+
+
+def default_table(name, depth, hash):
+    # Hashes of empty subtrees for every level. Computed once per (hash, depth) and
+    # shared by all trees of the process and its forked workers; persisted under
+    # $NDSMT_CACHE_DIR, if set.
+    key = (name, depth)
+    if key in default_tables:
+        return default_tables[key]
+    cache_dir = os.environ.get('NDSMT_CACHE_DIR')
+    fn = os.path.join(cache_dir, f"default-{name}-{depth}.json") if cache_dir else None
+    table = None
+    if fn and os.path.exists(fn):
+        with open(fn) as f:
+            table = tuple(int(v) for v in json.load(f))
+        if len(table) != depth + 1:
+            table = None
+    if table is None:
+        table = [default] * (depth + 1)
+        for i in range(1, depth + 1):
+            table[i] = hash(table[i-1], table[i-1])
+        table = tuple(table)
+        if fn:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(fn + '.tmp', 'w') as f:
+                json.dump([str(v) for v in table], f)
+            os.replace(fn + '.tmp', fn)
+    default_tables[key] = table
+    return table
+
+default_tables = {}
+
+
+# Poseidon implementations are imported on first use, they dominate cold start
+poseidon = None
+def poseidon_bn254(left, right):
+    global poseidon
+    if poseidon is None:
+        from circomlibpy.poseidon import PoseidonHash
+        poseidon = PoseidonHash()
+    return poseidon.hash(2, [left, right])
+
+poseidon_perm = None
+def poseidon_stark(left, right):
+    # Cairo's hardcoded Poseidon parameters:
+    # https://github.com/starkware-industries/poseidon/blob/main/poseidon3.txt
+    global poseidon_perm
+    if poseidon_perm is None:
+        from poseidon_py.poseidon_hash import poseidon_perm
+    return poseidon_perm(left, right, 2)[0]
+
+def hashlib_compress(name):
+    # inputs are 256-bit big-endian, the digest is read back as an integer
+    new = getattr(hashlib, name)
+    def compress(left, right):
+        h = new(left.to_bytes(32, 'big'))
+        h.update(right.to_bytes(32, 'big'))
+        return int.from_bytes(h.digest(), 'big')
+    return compress
+
+
+backends = {b.name: b for b in [
+    Backend('poseidon-bn254', poseidon_bn254, 'zero'),
+    Backend('poseidon-stark', poseidon_stark, 'passthrough'),
+    Backend('blake2s', hashlib_compress('blake2s'), 'zero'),
+    Backend('sha256', hashlib_compress('sha256'), 'zero'),
+]}
+
+
+def get_backend(backend):
+    # backend name or Backend
+    if isinstance(backend, Backend):
+        return backend
+    if backend not in backends:
+        raise ValueError(f"Unknown hash backend '{backend}', expected one of {', '.join(backends)}")
+    return backends[backend]
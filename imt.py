@@ -0,0 +1,254 @@
+from ndsmt import hash, jdump
+from hashes import get_backend
+import bisect
+import copy
+import random
+import sys
+
+# Indexed Merkle tree: leaves are appended at sequential indices of a shallow
+# (e.g. 2^32 capacity) tree, and every leaf also links to the leaf with the next
+# larger key. Thus leaf ordering is by insertion, and key ordering is by the
+# linked list.
+#
+# leaf preimage: [key, value, next_index, next_key]
+#   next_key == 0 marks the end of the list (the largest key so far)
+#   leaf at index 0 is the sentinel [0, 0, 0, 0], and key 0 is reserved
+#
+# Non-membership of key k is shown by the "low leaf" L, the predecessor of k:
+#   L.key < k < L.next_key  (or L.next_key == 0)
+
+KEY = 0
+VALUE = 1
+NEXT_INDEX = 2
+NEXT_KEY = 3
+
+
+def leaf_hash(leaf, hash=hash):
+    return hash(hash(leaf[KEY], leaf[VALUE]), hash(leaf[NEXT_KEY], leaf[NEXT_INDEX]))
+
+def low_leaf_covers(index, leaf, key):
+    # The sentinel hashes to 0, same as an empty slot, thus a leaf with key 0 is
+    # only accepted at index 0; anywhere else it would be a blank slot passed off
+    # as the sentinel.
+    if leaf[KEY] == 0 and index != 0:
+        return False
+    return leaf[KEY] < key and (leaf[NEXT_KEY] == 0 or key < leaf[NEXT_KEY])
+
+
+class IndexedMerkleTree:
+    def __init__(self, depth=32, backend='poseidon-bn254'):
+        self.depth = depth
+        # Node dictionary stores (level, index) -> value
+        self.nodes = {}
+        self.backend = get_backend(backend)
+        self.hash = self.backend.hash
+        self.default = self.backend.default_table(depth)
+        self.leaves = [[0, 0, 0, 0]]        # leaf preimages by index, sentinel first
+        self.index = {0: 0}                 # key -> leaf index
+        self.sorted_keys = [0]              # for finding low leaves
+        self.set_leaf(0, self.leaves[0])
+
+    def get_root(self):
+        return self.backend.root(self.get_node(self.depth, 0))
+
+    def size(self):
+        # number of leaves, sentinel included; the first index of the next batch
+        return len(self.leaves)
+
+    def get_node(self, level, index):
+        return self.nodes.get((level, index), self.default[level])
+
+    def set_leaf(self, index, leaf):
+        current = leaf_hash(leaf, self.hash)
+        self.nodes[(0, index)] = current
+        for level in range(self.depth):
+            sibling = self.get_node(level, index ^ 1)
+            current = self.hash(current, sibling) if index % 2 == 0 else self.hash(sibling, current)
+            index = index >> 1
+            self.nodes[(level + 1, index)] = current
+        return current
+
+    def siblings(self, index):
+        proof = []
+        for level in range(self.depth):
+            proof.append(self.get_node(level, index ^ 1))
+            index = index >> 1
+        return proof
+
+    def compute_root(self, index, leafhash, siblings):
+        current = leafhash
+        for level in range(self.depth):
+            sibling = siblings[level]
+            current = self.hash(current, sibling) if (index >> level) % 2 == 0 else self.hash(sibling, current)
+        return self.backend.root(current)
+
+    def low_leaf_index(self, key):
+        return self.index[self.sorted_keys[bisect.bisect_left(self.sorted_keys, key) - 1]]
+
+    def generate_inclusion_proof(self, key):
+        # returns (index, leaf, siblings) of an existing key
+        index = self.index[key]
+        return (index, list(self.leaves[index]), self.siblings(index))
+
+    def generate_non_inclusion_proof(self, key):
+        # returns (index, leaf, siblings) of the low leaf of an unknown key
+        if key in self.index:
+            raise ValueError(f"The key '{key}' is present")
+        return self.generate_inclusion_proof(self.leaves[self.low_leaf_index(key)][KEY])
+
+    def verify_inclusion_proof(self, key, value, proof):
+        index, leaf, siblings = proof
+        if leaf[KEY] != key or leaf[VALUE] != value:
+            return False
+        return self.compute_root(index, leaf_hash(leaf, self.hash), siblings)
+
+    def verify_non_inclusion_proof(self, key, proof):
+        index, leaf, siblings = proof
+        if not low_leaf_covers(index, leaf, key):
+            return False
+        return self.compute_root(index, leaf_hash(leaf, self.hash), siblings)
+
+    def insert(self, key, value):
+        # returns a proof step: low leaf before the update, its position and siblings,
+        # and the siblings of the appended leaf after the low leaf was updated
+        if key == 0 or key in self.index:
+            raise ValueError(f"The key '{key}' is already set or reserved")
+        new_index = len(self.leaves)
+        if new_index >= 2 ** self.depth:
+            raise OverflowError(f"Tree capacity 2^{self.depth} exhausted")
+
+        low_index = self.low_leaf_index(key)
+        low = self.leaves[low_index]
+        step = {'low_leaf': list(low), 'low_index': low_index, 'low_siblings': self.siblings(low_index)}
+
+        leaf = [key, value, low[NEXT_INDEX], low[NEXT_KEY]]
+        low[NEXT_INDEX] = new_index
+        low[NEXT_KEY] = key
+        self.set_leaf(low_index, low)
+
+        step['new_siblings'] = self.siblings(new_index)
+        self.leaves.append(leaf)
+        self.index[key] = new_index
+        bisect.insort(self.sorted_keys, key)
+        self.set_leaf(new_index, leaf)
+        return step
+
+    def batch_insert(self, keys, values):
+        # Appends the batch at sequential indices. Proof of consistency is the list of
+        # steps, one per key: every step is checked against the root left by the
+        # previous one, therefore keys within the batch may be each other's low leaves.
+        if len(set(keys)) != len(keys):
+            raise ValueError("Duplicate keys in batch")
+        for key in keys:
+            if key == 0 or key in self.index:
+                raise ValueError(f"The key '{key}' is already set or reserved")
+        if len(self.leaves) + len(keys) > 2 ** self.depth:
+            raise OverflowError(f"Tree capacity 2^{self.depth} exhausted")
+
+        proof = {'start': len(self.leaves), 'steps': []}
+        for key, value in zip(keys, values):
+            proof['steps'].append(self.insert(key, value))
+        return proof
+
+    def verify_non_deletion(self, proof, old_root, new_root, keys, values, start):
+        # start is the leaf count of old_root, as tracked by the verifier: the batch
+        # is appended from there, proof['start'] is only checked against it.
+        # For every key, in order:
+        #   1. low leaf brackets the key, thus the key was absent
+        #   2. low leaf is included in the current root
+        #   3. only the next pointers of the low leaf change
+        #   4. the slot at the next sequential index was empty
+        #   5. the new leaf takes over the low leaf's old pointers
+        # The low leaf's key and value are re-used by the verifier, and the appended
+        # slot was blank, thus nothing was overwritten.
+        steps = proof['steps']
+        if len(steps) != len(keys) or len(keys) != len(values):
+            print("Non-deletion proof length mismatch", file=sys.stderr)
+            return False
+        if proof.get('start', start) != start:
+            print(f"Non-deletion proof starts at {proof['start']}, expected {start}", file=sys.stderr)
+            return False
+
+        root = old_root
+        for i, (key, value, step) in enumerate(zip(keys, values, steps)):
+            new_index = start + i
+            low, low_index = step['low_leaf'], step['low_index']
+            if key == 0 or not low_leaf_covers(low_index, low, key):
+                print(f"Low leaf {low} does not cover key {key}", file=sys.stderr)
+                return False
+            if new_index >= 2 ** self.depth or low_index == new_index:
+                print(f"Bad leaf index {new_index}", file=sys.stderr)
+                return False
+
+            r = self.compute_root(low_index, leaf_hash(low, self.hash), step['low_siblings'])
+            if r != root:
+                print(f"Non-deletion proof low leaf root mismatch at {i}: r:{r}, root:{root}", file=sys.stderr)
+                return False
+
+            updated = [low[KEY], low[VALUE], new_index, key]
+            root = self.compute_root(low_index, leaf_hash(updated, self.hash), step['low_siblings'])
+
+            r = self.compute_root(new_index, self.default[0], step['new_siblings'])
+            if r != root:
+                print(f"Non-deletion proof empty slot root mismatch at {i}: r:{r}, root:{root}", file=sys.stderr)
+                return False
+
+            leaf = [key, value, low[NEXT_INDEX], low[NEXT_KEY]]
+            root = self.compute_root(new_index, leaf_hash(leaf, self.hash), step['new_siblings'])
+
+        if root != new_root:
+            print(f"Non-deletion proof root mismatch: r:{root}, newr:{new_root}", file=sys.stderr)
+            return False
+        return True
+
+
+def main():
+    depth = 32
+
+    imt = IndexedMerkleTree(depth)
+
+    # pre-filling the tree
+    keys = list({random.randint(1, 2**64) for _ in range(100)})
+    values = [k % 1000 for k in keys]
+    old_root, start = imt.get_root(), imt.size()
+    proof = imt.batch_insert(keys, values)
+    new_root = imt.get_root()
+    assert imt.verify_non_deletion(proof, old_root, new_root, keys, values, start)
+
+    key = keys[0]
+    assert imt.verify_inclusion_proof(key, values[0], imt.generate_inclusion_proof(key)) == new_root
+    missing = key + 1 if key + 1 not in imt.index else key - 1
+    assert imt.verify_non_inclusion_proof(missing, imt.generate_non_inclusion_proof(missing)) == new_root
+
+    # an empty slot passed off as the sentinel must not prove absence of a present key
+    empty = imt.size() + 10
+    forged = (empty, [0, 0, 0, 0], imt.siblings(empty))
+    assert imt.compute_root(empty, imt.default[0], forged[2]) == new_root
+    assert not imt.verify_non_inclusion_proof(key, forged)
+
+    # nor re-insert it: the low leaf is the blank slot right after the appended one
+    size = imt.size()
+    forged = copy.deepcopy(imt)
+    step = {'low_leaf': [0, 0, 0, 0], 'low_index': size + 1, 'low_siblings': forged.siblings(size + 1)}
+    forged.set_leaf(size + 1, [0, 0, size, key])
+    step['new_siblings'] = forged.siblings(size)
+    forged.set_leaf(size, [key, 1, 0, 0])
+    assert not imt.verify_non_deletion({'start': size, 'steps': [step]}, new_root, forged.get_root(), [key], [1], size)
+
+    # batch for proving
+    keys = [k for k in {random.randint(1, 2**64) for _ in range(20)} if k not in imt.index]
+    values = [k % 1000 for k in keys]
+    old_root, start = new_root, imt.size()
+    proof = imt.batch_insert(keys, values)
+    new_root = imt.get_root()
+    assert imt.verify_non_deletion(proof, old_root, new_root, keys, values, start)
+    # the appended slots are fixed by the verifier's leaf count, not by the proof
+    assert not imt.verify_non_deletion(dict(proof, start=start + 1), old_root, new_root, keys, values, start)
+    assert not imt.verify_non_deletion(proof, old_root, new_root, keys, values, start + 1)
+
+    print(jdump({'old_root': old_root, 'new_root': new_root,
+                 'keys': keys, 'values': values, 'proof': proof, 'depth': depth}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import math
+import os
+import sys
+
+# Bloom filter over all committed leaf keys, consulted before a key enters a batch.
+# A negative answer is final, only positive answers fall through to the exact (and
+# possibly disk-backed) node store lookup. Rounds opened with
+# smt.open_round(keyfilter) consult it on admit() and add their keys on close();
+# batches for batch_insert go through admit_batch() first and commit() after.
+#
+# Checkpoint file: one line of JSON header, followed by the raw bit array. The header
+# records the root the filter was saved at; after a restart, keys of the rounds
+# committed after that root are added again.
+
+
+class KeyFilter:
+    def __init__(self, exists, capacity=1 << 20, error_rate=0.001):
+        # exists(key) -> bool is the exact lookup
+        self.exists = exists
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.m = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.k = max(1, round(self.m / capacity * math.log(2)))
+        self.bits = bytearray((self.m + 7) // 8)
+        self.count = 0
+        self.lookups = 0            # exact lookups, that is, positive answers
+        self.false_positives = 0
+
+    def positions(self, key):
+        # double hashing, two 64 bit halves of a single digest
+        d = hashlib.blake2b(key.to_bytes((key.bit_length() + 7) // 8 or 1, 'big'), digest_size=16).digest()
+        h1 = int.from_bytes(d[:8], 'big')
+        h2 = int.from_bytes(d[8:], 'big') | 1
+        return [(h1 + i * h2) % self.m for i in range(self.k)]
+
+    def add(self, key):
+        for p in self.positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+        if self.count == self.capacity + 1:
+            print(f"Key filter over capacity {self.capacity}, false positive rate grows", file=sys.stderr)
+
+    def might_contain(self, key):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self.positions(key))
+
+    def admit(self, key):
+        # True if the key is not yet committed
+        if not self.might_contain(key):
+            return True
+        self.lookups += 1
+        if self.exists(key):
+            return False
+        self.false_positives += 1
+        return True
+
+    def admit_batch(self, keys, values):
+        # filters out committed keys and duplicates within the batch
+        seen = set()
+        new_keys, new_values = [], []
+        for key, value in zip(keys, values):
+            if key in seen or not self.admit(key):
+                print(f"The leaf '{key}' is already set, skipping.", file=sys.stderr)
+                continue
+            seen.add(key)
+            new_keys.append(key)
+            new_values.append(value)
+        return new_keys, new_values
+
+    def commit(self, keys):
+        for key in keys:
+            self.add(key)
+
+    def save(self, fn, root):
+        header = {'m': self.m, 'k': self.k, 'count': self.count, 'capacity': self.capacity,
+                  'error_rate': self.error_rate, 'root': str(root)}
+        # written aside and renamed, a crash never leaves a torn checkpoint
+        with open(fn + '.tmp', 'wb') as f:
+            f.write(json.dumps(header).encode() + b'\n')
+            f.write(self.bits)
+        os.replace(fn + '.tmp', fn)
+
+    @classmethod
+    def load(cls, fn, exists):
+        # returns the filter and the root it was saved at
+        with open(fn, 'rb') as f:
+            header = json.loads(f.readline())
+            kf = cls(exists, header['capacity'], header['error_rate'])
+            if (kf.m, kf.k) != (header['m'], header['k']):
+                raise ValueError(f"Key filter checkpoint {fn} has unexpected parameters")
+            kf.bits = bytearray(f.read())
+            if len(kf.bits) != (kf.m + 7) // 8:
+                raise ValueError(f"Key filter checkpoint {fn} is truncated")
+            kf.count = header['count']
+        return kf, int(header['root'])
+
+
+def main():
+    from ndsmt import SparseMerkleTree
+    import random
+    import tempfile
+
+    committed = set(random.sample(range(1 << 32), 1000))
+    kf = KeyFilter(committed.__contains__, capacity=1000, error_rate=0.01)
+    kf.commit(committed)
+    assert all(not kf.admit(key) for key in committed)
+
+    # positive answers of absent keys fall through to the exact lookup and are admitted
+    absent = range(1 << 33, (1 << 33) + 10000)
+    assert all(kf.admit(key) for key in absent)
+    assert 0 < kf.false_positives < 500 and kf.lookups == len(committed) + kf.false_positives
+
+    # save and load give the same filter and root
+    with tempfile.TemporaryDirectory() as d:
+        fn = d + '/keyfilter'
+        kf.save(fn, 12345)
+        loaded, root = KeyFilter.load(fn, committed.__contains__)
+        assert root == 12345 and loaded.bits == kf.bits and loaded.count == kf.count
+        assert all(not loaded.admit(key) for key in committed)
+        with open(fn, 'r+b') as f:
+            f.truncate(100)
+        try:
+            KeyFilter.load(fn, committed.__contains__)
+            assert False
+        except ValueError:
+            pass
+
+    # consulted by an open round, which commits its batch to the filter on close
+    smt = SparseMerkleTree(32, 'blake2s')
+    kf = KeyFilter(smt.has_leaf, capacity=1000)
+    r = smt.open_round(kf)
+    assert r.admit(5, 1) and r.admit(9, 1)
+    r.close()
+    assert kf.count == 2 and kf.might_contain(5)
+    r = smt.open_round(kf)
+    assert not r.admit(5, 2) and r.admit(7, 1)
+    print(f"okay, {kf.lookups} exact lookups")
+
+
+if __name__ == "__main__":
+    main()
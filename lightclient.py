@@ -0,0 +1,126 @@
+from hashes import get_backend, default
+from collections import OrderedDict
+import random
+
+# Verifier of inclusion and non-inclusion proofs (as returned by
+# SparseMerkleTree.generate_inclusion_proof) against one certified root.
+#
+# Every node computed or used on the way to the root of an accepted proof is
+# authenticated by that root. These nodes are remembered as (level, index) -> hash,
+# where index is key >> level. A later proof is hashed upwards only until it meets a
+# remembered node; then it is accepted if the computed hash equals the remembered one,
+# and rejected otherwise. Remembered siblings are checked the same way.
+#
+# Memory is bounded by 'budget' nodes; the least recently used nodes are forgotten,
+# which costs only re-hashing.
+#
+# The backend must be the one of the tree that produced the root; a root tagged with
+# another backend is refused.
+
+
+class RootVerifier:
+    def __init__(self, root, depth, budget=1 << 16, backend='poseidon-bn254'):
+        self.backend = get_backend(backend)
+        if getattr(root, 'backend', self.backend.name) != self.backend.name:
+            raise ValueError(f"Root of backend '{root.backend}', expected '{self.backend.name}'")
+        self.hash = self.backend.hash
+        self.root = root
+        self.depth = depth
+        self.budget = budget
+        self.known = OrderedDict()
+        self.hashes = 0         # number of hash evaluations, for statistics
+        self.shortcuts = 0      # proofs accepted below the root
+
+    def authenticate(self, key, leaf, proof):
+        current = leaf
+        seen = []
+        for level in range(self.depth):
+            index = key >> level
+            known = self.known.get((level, index))
+            if known is not None:
+                if known != current:
+                    return False
+                self.known.move_to_end((level, index))
+                self.shortcuts += 1
+                break
+
+            sibling = proof[level]
+            known = self.known.get((level, index ^ 1))
+            if known is not None and known != sibling:
+                return False
+            seen.append(((level, index), current))
+            seen.append(((level, index ^ 1), sibling))
+
+            if index % 2 == 0:
+                current = self.hash(current, sibling)
+            else:
+                current = self.hash(sibling, current)
+            self.hashes += 1
+        else:
+            if current != self.root:
+                return False
+
+        for node, value in seen:
+            self.known[node] = value
+            self.known.move_to_end(node)
+        while len(self.known) > self.budget:
+            self.known.popitem(last=False)
+        return True
+
+    def verify_inclusion_proof(self, key, value, proof):
+        return self.authenticate(key, value, proof)
+
+    def verify_non_inclusion_proof(self, key, proof):
+        return self.authenticate(key, default, proof)
+
+
+def main():
+    from ndsmt import SparseMerkleTree  # the light client itself needs no tree
+
+    depth = 32
+    smt = SparseMerkleTree(depth, 'blake2s')
+    keys = random.sample(range(2**depth), 200)
+    for key in keys:
+        smt.insert(key, key + 1)
+    root = smt.get_root()
+
+    verifier = RootVerifier(root, depth, backend='blake2s')
+    for key in keys[:100]:
+        assert verifier.verify_inclusion_proof(key, key + 1, smt.generate_inclusion_proof(key))
+    missing = next(k for k in range(2**depth) if not smt.has_leaf(k))
+    assert verifier.verify_non_inclusion_proof(missing, smt.generate_inclusion_proof(missing))
+    assert verifier.shortcuts > 0
+
+    # tampered proofs are rejected, by the root or by a remembered node they meet
+    key = keys[0]
+    assert not verifier.verify_inclusion_proof(key, key + 2, smt.generate_inclusion_proof(key))
+    assert not verifier.verify_non_inclusion_proof(key, smt.generate_inclusion_proof(key))
+
+    def tamper(proof, level):
+        proof = list(proof)
+        proof[level] += 1
+        return proof
+
+    key = keys[150]     # not verified yet, meets remembered nodes on the way up
+    proof = smt.generate_inclusion_proof(key)
+    assert not verifier.verify_inclusion_proof(key, key + 1, tamper(proof, 0))
+    assert verifier.verify_inclusion_proof(key, key + 1, proof)
+
+    fresh = RootVerifier(root, depth, backend='blake2s')
+    key = keys[1]
+    proof = smt.generate_inclusion_proof(key)
+    for level in (0, depth - 1):
+        assert not fresh.verify_inclusion_proof(key, key + 1, tamper(proof, level))
+    assert fresh.verify_inclusion_proof(key, key + 1, proof)
+
+    # and so is a root of another backend
+    try:
+        RootVerifier(root, depth)
+        assert False
+    except ValueError:
+        pass
+    print(f"okay, {verifier.hashes} hashes, {verifier.shortcuts} shortcuts")
+
+
+if __name__ == "__main__":
+    main()
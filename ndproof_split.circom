@@ -0,0 +1,7 @@
+pragma circom 2.0.6;
+
+include "forest.circom";
+
+// NdVerifierSplit(DEPTH, WIDTH, NG, SEG): NG proof segments of SEG elements each;
+// input from 'python3 ndsmt.py --groups 4 --segment 16'
+component main {public [batch, root1, root2]} = NdVerifierSplit(32, 20, 4, 16);
@@ -1,11 +1,15 @@
 # import hashlib
-from circomlibpy.poseidon import PoseidonHash
+import argparse
+import bisect
 import pprint
 import sys
 import random
 import json
-
-default = 0  # default 'empty' leaf
+import copy
+import threading
+from collections import ChainMap
+from planner import plan_batch
+from hashes import get_backend, default  # default 'empty' leaf
 
 def dump(d):
     pprint.pp(d, width=220)
@@ -17,38 +21,43 @@ class CustomJSONEncoder(json.JSONEncoder):
 def jdump(d):
     return json.dumps(d, cls=CustomJSONEncoder, indent=4)
 
-poseidon = PoseidonHash()
-def hash(left, right):
-    if left == default and right == default:
-        return default
-    else:
-        return poseidon.hash(2, [left, right])
+hash = get_backend('poseidon-bn254').hash  # the hash of ndproof.circom
 
 
 class SparseMerkleTree:
-    def __init__(self, depth=256):
+    def __init__(self, depth=256, backend='poseidon-bn254'):
+        # backend: see hashes.py, only Poseidon BN254 matches the circuit
         self.depth = depth
         self.nodes = {}
-        self.default = [default] * (depth + 1)
-        # Precompute default hashes for each level
-        for i in range(1, depth + 1):
-            self.default[i] = hash(self.default[i-1], self.default[i-1])
-
+        self.leaf_keys = []         # sorted keys of the leaves, see sorted_leaf_keys
+        self.leaf_pending = []      # keys inserted since the last merge
+        self.backend = get_backend(backend)
+        self.hash = self.backend.hash
+        self.default = self.backend.default_table(depth)
 
     def get_root(self):
-        return self.get_node(self.depth, '')
+        return self.backend.root(self.get_node(self.depth, ''))
 
     def get_node(self, level, path):
         return self.nodes.get((level, path), self.default[level])
 
+    def has_leaf(self, key):
+        return (0, self.key_to_bits(key)) in self.nodes
+
     def update_node(self, level, path, value):
         if level == 0 and not (self.nodes.get((0, path)) is None):
             print(f"The leaf '{path}' is already set", file=sys.stderr)
             return
+        if level == 0:
+            self.leaf_pending.append(int(path, 2))
         self.nodes[(level, path)] = value
 
     def insert(self, key, value):
         path = self.key_to_bits(key)
+        if (0, path) in self.nodes:
+            # refuse before any of the path is rehashed
+            print(f"The leaf '{path}' is already set", file=sys.stderr)
+            return self.get_root()
         current = value
         self.update_node(0, path, current)
 
@@ -63,9 +72,9 @@ class SparseMerkleTree:
                 left = self.get_node(level-1, parent_path + '0')
                 right = current
 
-            current = hash(left, right)
+            current = self.hash(left, right)
             self.update_node(level, parent_path, current)
-        return current
+        return self.backend.root(current)
 
     def generate_inclusion_proof(self, key):
         # returns inclusion proof for existing key
@@ -113,14 +122,6 @@ class SparseMerkleTree:
 
             return paths
 
-        def prefix_free(bitstrings):
-            result = set()
-            for s in sorted(bitstrings, key=lambda x: (len(x), x)):
-                if not any(other.startswith(s) and other != s for other in bitstrings):
-                    result.add(s)
-
-            return result
-
         siblings = []
         paths = []
         for key in keys:
@@ -129,7 +130,9 @@ class SparseMerkleTree:
             paths += [path]
 
         siblings = set(siblings) - set(paths)
-        siblings = prefix_free(siblings)
+        # remove prefixes: a sibling which is a prefix of another one is on the path
+        # of a key, that is, a proper prefix of that key
+        siblings = siblings - {path[:n] for path in paths for n in range(len(path))}
         return siblings
 
     def verify_inclusion_proof(self, key, value, proof):
@@ -141,11 +144,11 @@ class SparseMerkleTree:
             bit = path[-level-1] if level < len(path) else '0'
 
             if bit == '0':
-                current = hash(current, sibling)
+                current = self.hash(current, sibling)
             else:
-                current = hash(sibling, current)
+                current = self.hash(sibling, current)
 
-        return current
+        return self.backend.root(current)
 
     def verify_non_inclusion_proof(self, key, proof):
         path = self.key_to_bits(key)
@@ -156,18 +159,127 @@ class SparseMerkleTree:
             bit = path[-level-1] if level < len(path) else '0'
 
             if bit == '0':
-                current = hash(current, sibling)
+                current = self.hash(current, sibling)
             else:
-                current = hash(sibling, current)
+                current = self.hash(sibling, current)
+
+        return self.backend.root(current)
+
+    def sorted_leaf_keys(self):
+        # Keys inserted since the last call are merged here, into a new list: running
+        # scans keep iterating the keys present when they started.
+        if self.leaf_pending:
+            # pending keys are in insertion order: sorted on their own, O(p log p), then
+            # the two sorted runs are merged by the sort in linear time
+            keys = self.leaf_keys + sorted(self.leaf_pending)
+            keys.sort()
+            self.leaf_keys = keys
+            self.leaf_pending = []
+        return self.leaf_keys
+
+    def prefix_range(self, prefix):
+        # keys under the bit string prefix: [lo, hi)
+        shift = self.depth - len(prefix)
+        lo = int(prefix, 2) << shift if prefix else 0
+        return lo, lo + (1 << shift)
+
+    def leaves(self, lo=0, hi=None):
+        # (key, value) in key order, for lo <= key < hi; streaming, without copying
+        keys = self.sorted_leaf_keys()
+        i = bisect.bisect_left(keys, lo)
+        j = len(keys) if hi is None else bisect.bisect_left(keys, hi)
+        for n in range(i, j):
+            key = keys[n]
+            yield key, self.nodes[(0, self.key_to_bits(key))]
+
+    def prefix_leaves(self, prefix):
+        return self.leaves(*self.prefix_range(prefix))
+
+    def range_positions(self, lo, hi):
+        # Subtrees covering the keys outside [lo, hi), in key order: the left siblings
+        # on the path of lo cover [0, lo), the right siblings on the path of hi - 1
+        # cover [hi, 2^depth).
+        if not 0 <= lo < hi <= 1 << self.depth:
+            raise ValueError(f"Range [{lo}, {hi}) out of range of depth {self.depth}")
+        first, last = self.key_to_bits(lo), self.key_to_bits(hi - 1)
+        before = [first[:n] + '0' for n in range(self.depth) if first[n] == '1']
+        after = [last[:n] + '1' for n in reversed(range(self.depth)) if last[n] == '0']
+        return before, after
+
+    def range_proof(self, lo, hi):
+        # range-completeness proof of the leaves in [lo, hi): the non-default subtrees
+        # outside the range
+        before, after = self.range_positions(lo, hi)
+        proof = {}
+        for k in before + after:
+            v = self.get_node(self.depth - len(k), k)
+            if v != default:
+                proof[k] = v
+        return proof
 
-        return current
+    def verify_range(self, lo, hi, leaves, proof, root):
+        # True if leaves, (key, value) in key order, are exactly the leaves in [lo, hi)
+        # of the tree at root. Nodes are hashed as they stream in, disjoint subtrees
+        # left to right, and memory stays O(depth): a stack entry is merged as soon as
+        # the next node lies outside its common ancestor with the entry below it.
+        # Positions of the proof are derived from the range, other entries are ignored.
+        before, after = self.range_positions(lo, hi)
+        stack = []
+
+        def lca(a, b):
+            level = max(a[0], b[0])
+            x, y = a[1] >> (level - a[0]), b[1] >> (level - b[0])
+            while x != y:
+                x, y, level = x >> 1, y >> 1, level + 1
+            return level
+
+        def lift(node, level):
+            l, i, v = node
+            for l in range(l, level):
+                v = self.hash(v, self.default[l]) if i % 2 == 0 else self.hash(self.default[l], v)
+                i >>= 1
+            return level, i, v
+
+        def merge():
+            b, a = stack.pop(), stack.pop()
+            level = lca(a, b)
+            _, i, va = lift(a, level - 1)
+            _, _, vb = lift(b, level - 1)
+            stack.append((level, i >> 1, self.hash(va, vb)))
+
+        def push(node):
+            while len(stack) >= 2 and lca(stack[-2], stack[-1]) <= lca(stack[-1], node):
+                merge()
+            stack.append(node)
+
+        for k in before:
+            if k in proof:
+                push((self.depth - len(k), int(k, 2), proof[k]))
+        previous = lo - 1
+        for key, value in leaves:
+            if not previous < key < hi:
+                print(f"Range proof: leaf {key} out of order or out of range [{lo}, {hi})", file=sys.stderr)
+                return False
+            previous = key
+            push((0, key, value))
+        for k in after:
+            if k in proof:
+                push((self.depth - len(k), int(k, 2), proof[k]))
+        while len(stack) >= 2:
+            merge()
+
+        r = self.backend.root(lift(stack[0], self.depth)[2] if stack else self.default[self.depth])
+        if r != root:
+            print(f"Range proof root mismatch: r:{r}, root:{root}", file=sys.stderr)
+            return False
+        return True
 
     def key_to_bits(self, key):
         # Convert key to a string of 'depth' bits
         #return format(int.from_bytes(key, 'big'), '0{}b'.format(self.depth))
         return format(key, '0{}b'.format(self.depth))
 
-    def batch_insert(self, keys, values):
+    def consistency_proof(self, keys):
         proof = {}
         # proof of consistency: collect all siblings necessary to compute root
         # based on new batch of keys
@@ -179,6 +291,10 @@ class SparseMerkleTree:
             v = self.get_node(level, k)
             if v != default:
                 proof[k] = v
+        return proof
+
+    def batch_insert(self, keys, values):
+        proof = self.consistency_proof(keys)
 
         # Perform all insertions
         for key, value in zip(keys, values):
@@ -188,32 +304,41 @@ class SparseMerkleTree:
 
         return proof
 
-    def verify_non_deletion(self, proof, old_root, new_root, keys, values):
-        def compute_forest(forest, path):
-            for level in reversed(range(self.depth+1)):
-                last_parent = None
-                for k in sorted([key for key in forest if len(key) == level]):
-                    parent = k[:-1]
-                    if parent == last_parent:
-                        continue
-                    sibling = k[:-1] + ('1' if k[-1] == '0' else '0')
-                    pv = hash(forest[k], forest.get(sibling, default)) if k[-1] == '0' else hash(forest.get(sibling, default), forest[k])
-                    if parent in forest:
-                        print(f"redundant parent {parent} in proof", file=sys.stderr)
-                        if forest[parent] != pv:
-                            raise Exception(f"parent mismatch {parent}->{forest[parent]}/{pv} in proof")
-                    if parent == path:
-                        return pv
-                    forest[parent] = pv
-                    last_parent = parent
-            return False
+    def stage(self, keys, values, width=None):
+        # dry run of batch_insert, see StagedBatch
+        return StagedBatch(self, keys, values, width)
+
+    def open_round(self, keyfilter=None):
+        # batch_insert with the proof positions collected key by key, see OpenRound
+        return OpenRound(self, keyfilter)
+
+    def compute_forest(self, forest, path=''):
+        # hashes the forest (path -> value, modified in place) up to the node at 'path'
+        for level in reversed(range(self.depth+1)):
+            last_parent = None
+            for k in sorted([key for key in forest if len(key) == level]):
+                parent = k[:-1]
+                if parent == last_parent:
+                    continue
+                sibling = k[:-1] + ('1' if k[-1] == '0' else '0')
+                pv = self.hash(forest[k], forest.get(sibling, default)) if k[-1] == '0' else self.hash(forest.get(sibling, default), forest[k])
+                if parent in forest:
+                    print(f"redundant parent {parent} in proof", file=sys.stderr)
+                    if forest[parent] != pv:
+                        raise Exception(f"parent mismatch {parent}->{forest[parent]}/{pv} in proof")
+                if parent == path:
+                    return self.backend.root(pv) if path == '' else pv
+                forest[parent] = pv
+                last_parent = parent
+        return False
 
+    def verify_non_deletion(self, proof, old_root, new_root, keys, values):
         # step 1. compute old root based on proof and 'empty' leaves in place of new batch
         p1 = proof.copy()
         for key in keys:
             p1[self.key_to_bits(key)] = self.default[0]
 
-        r1 = compute_forest(p1, '')
+        r1 = self.compute_forest(p1, '')
         if r1 != old_root:
             print(f"Non-deletion proof root mismatch: r:{r1}, oldr:{old_root}", file=sys.stderr)
             #return False
@@ -223,7 +348,7 @@ class SparseMerkleTree:
         for key, value in zip(keys, values):
             p2[self.key_to_bits(key)] = value
 
-        r2 = compute_forest(p2, '')
+        r2 = self.compute_forest(p2, '')
         if r2 != new_root:
             print(f"Non-deletion proof root mismatch: r:{r1}, newr:{new_root}", file=sys.stderr)
             return False
@@ -239,93 +364,326 @@ class SparseMerkleTree:
         #  thus nothing was overwritten
         return True
 
-    def prepare_witness(self, forest, keys, values, width):
-
-        def deptharray(dict):
-            # returns the matrix [level][keys]
-            result = [[] for _ in range(self.depth + 1)]
-            for key, value in sorted(dict.items()):
-                keylen = len(key)
-                result[keylen].append(key)
-            return result
+    def partition_proof(self, proof, keys, values, s):
+        # Splits the consistency proof of a batch by the top s bits of its keys into
+        # independent sub-proofs, one for every touched subtree of depth (depth - s),
+        # and a top-level proof linking the subtree roots to the tree's root:
+        #   sub: {'prefix', 'old_root', 'new_root', 'keys', 'values', 'proof'}, with keys
+        #        and proof paths relative to the subtree; verified (and proven, with
+        #        DEPTH = depth - s) like any other consistency proof
+        #   top: {'depth', 'prefixes', 'old_roots', 'new_roots', 'proof'}, depth is s,
+        #        the proof holds the untouched subtrees and above
+        if not 0 < s < self.depth:
+            raise ValueError(f"Split {s} out of range 1..{self.depth - 1}")
+        subtree = SparseMerkleTree(self.depth - s, self.backend)
+        mask = (1 << (self.depth - s)) - 1
+
+        subs = {}
+        for key, value in zip(keys, values):
+            prefix = self.key_to_bits(key)[:s]
+            sub = subs.setdefault(prefix, {'prefix': prefix, 'keys': [], 'values': [], 'proof': {}})
+            sub['keys'].append(key & mask)
+            sub['values'].append(value)
+        top = {'depth': s, 'prefixes': sorted(subs), 'proof': {}}
+        for k, v in proof.items():
+            if len(k) <= s:
+                top['proof'][k] = v
+            else:
+                subs[k[:s]]['proof'][k[s:]] = v
+
+        subs = [subs[prefix] for prefix in top['prefixes']]
+        for sub in subs:
+            forest = dict(sub['proof'])
+            for key in sub['keys']:
+                forest[subtree.key_to_bits(key)] = subtree.default[0]
+            sub['old_root'] = subtree.compute_forest(forest)
+            forest = dict(sub['proof'])
+            for key, value in zip(sub['keys'], sub['values']):
+                forest[subtree.key_to_bits(key)] = value
+            sub['new_root'] = subtree.compute_forest(forest)
+        top['old_roots'] = [sub['old_root'] for sub in subs]
+        top['new_roots'] = [sub['new_root'] for sub in subs]
+        return top, subs
+
+    def verify_partitioned(self, top, subs, old_root, new_root):
+        # sub-proofs: only the batch leaves changed in every touched subtree, and they
+        # were empty; top: only the touched subtrees changed, from their old roots to
+        # their new roots
+        s = top['depth']
+        if not 0 < s < self.depth or [sub['prefix'] for sub in subs] != top['prefixes'] \
+                or len(set(top['prefixes'])) != len(subs) or any(len(p) != s for p in top['prefixes']):
+            print("Partitioned proof: bad prefixes", file=sys.stderr)
+            return False
+        if not subs:
+            # empty batch, same as verify_non_deletion
+            return old_root == new_root
+
+        subtree = SparseMerkleTree(self.depth - s, self.backend)
+        for sub, old, new in zip(subs, top['old_roots'], top['new_roots']):
+            forest = dict(sub['proof'])
+            for key in sub['keys']:
+                forest[subtree.key_to_bits(key)] = subtree.default[0]
+            r = subtree.compute_forest(forest)
+            if r != old:
+                print(f"Partitioned proof: subtree {sub['prefix']} root mismatch: r:{r}, oldr:{old}", file=sys.stderr)
+                return False
+            if not subtree.verify_non_deletion(sub['proof'], old, new, sub['keys'], sub['values']):
+                return False
+
+        # siblings of the touched subtrees, at positions derived from the prefixes
+        affected = {p[:n] for p in top['prefixes'] for n in range(s + 1)}
+        siblings = {p[:-1] + ('1' if p[-1] == '0' else '0') for p in affected if p} - affected
+        for roots, root in ((top['old_roots'], old_root), (top['new_roots'], new_root)):
+            forest = {k: top['proof'][k] for k in siblings if k in top['proof']}
+            forest.update(zip(top['prefixes'], roots))
+            r = self.compute_forest(forest)
+            if r != root:
+                print(f"Partitioned proof: top root mismatch: r:{r}, root:{root}", file=sys.stderr)
+                return False
+        return True
 
-        # (var naming)   k-v dict    matrix[layer]  output array
-        #                --------    ------         ------------
-        # input batch:   kv          bm             batch[self.depth]
-        # proof:         forest      fm             proof
+    def prepare_partitioned_witness(self, subs, width):
+        # witness for every sub-proof, for ndproof.circom instantiated with DEPTH = depth - s
+        if not subs:
+            return []
+        subtree = SparseMerkleTree(self.depth - len(subs[0]['prefix']), self.backend)
+        return [subtree.prepare_witness(sub['proof'], sub['keys'], sub['values'], width) for sub in subs]
+
+    def prepare_witness(self, forest, keys, values, width, groups=None, segment=None):
+        # groups: split the proof into this many segments for ndproof_split.circom,
+        # circuit layer d (0 is the leaf layer) uses segment d % groups. Interleaved,
+        # as proof elements concentrate in the layers near the root. The control wires
+        # index the segment of their layer, and proof is a list of segments of at most
+        # 'segment' elements each.
+
+        # (var naming)   k-v dict    nodes[layer]   output array
+        #                --------    ------------   ------------
+        # input batch:   kv          plan.nodes     batch[self.depth]
+        # proof:         forest                     proof
         #
         kv = {self.key_to_bits(key): value for key, value in zip(keys, values)}
 
-        bm = deptharray(kv)
-        fm = deptharray(forest)
+        # nodes on the paths of the batch at every layer, sorted, and which of them
+        # pair up with the next node as left and right child of the same parent
+        plan = plan_batch(set(keys), self.depth)
 
         # returned witness + instance
         wiringL = [[0] * width for _ in range(self.depth)]
         wiringR = [[0] * width for _ in range(self.depth)]
-        proof = []
+        segments = [[] for _ in range(groups or 1)]
         batch = [[] for _ in range(self.depth+1)]
         # collect some statistics: width utilized and number of proof elements used at every layer
         stats = [0 for _ in range(self.depth)]
         stats2 = [0 for _ in range(self.depth)]
         for level in reversed(range(1, self.depth+1)):
-            for w in range(width+1): # loop over cells, one too wide to catch overflow
-
-                if len(bm[level]) <= 0:
-                    stats[level-1] = w  # number includes zeroth cell
-                    break
-                k = bm[level].pop(0)
-
+            nodes = plan.nodes[self.depth - level]
+            pair = plan.pair[self.depth - level]
+            bits = '0{}b'.format(level)
+            proof = segments[(self.depth - level) % (groups or 1)]
+            i = 0
+            w = 0  # loop over cells
+            while i < len(nodes):
                 if w >= width:
                     raise OverflowError(f"Circuit width overflow. w: {w}, level: {level}")
 
+                k = format(nodes[i], bits)
                 batch[level].append(kv.get(k, None))  # append value to output vector
 
-                sibling = k[:-1] + ('1' if k[-1] == '0' else '0')
-                # check if there is sibling provided in proof
-                sv = forest.get(sibling, None)
-                if sv is None:
-                    if len(bm[level]) > 0 and bm[level][0] == sibling:  # see if next input is the sibling
-                        k2 = bm[level].pop(0)
+                if pair[i]:
+                    # next input is the (right) sibling
+                    # index of 1st element is 1 because 0 is hardwired to 'empty'
+                    i += 1
+                    wiringL[level-1][w] = len(batch[level])
+                    batch[level].append(kv.get(format(nodes[i], bits), None))
+                    wiringR[level-1][w] = len(batch[level])
+                else:
+                    sibling = k[:-1] + ('1' if k[-1] == '0' else '0')
+                    # check if there is sibling provided in proof
+                    sv = forest.get(sibling, None)
+                    if sv is None:
+                        # no sibling provided - thus "empty";
                         if k[-1] == '0':
-                            # index of 1st element is 1 because 0 is hardwired to 'empty'
                             wiringL[level-1][w] = len(batch[level])
-                            batch[level].append(kv.get(k2, None))
-                            wiringR[level-1][w] = len(batch[level])
+                            wiringR[level-1][w] = 0
                         else:
                             wiringR[level-1][w] = len(batch[level])
-                            batch[level].append(kv.get(k2, None))
-                            wiringL[level-1][w] = len(batch[level])
+                            wiringL[level-1][w] = 0
                     else:
-                        # no sibling provided - thus "empty";
+                        # sibling from proof
+                        stats2[level-1] = stats2[level-1] + 1
+                        if segment is not None and len(proof) >= segment:
+                            raise OverflowError(f"Proof segment overflow. level: {level}, segment: {segment}")
+                        proof.append(sv)
                         if k[-1] == '0':
                             wiringL[level-1][w] = len(batch[level])
-                            wiringR[level-1][w] = 0
+                            wiringR[level-1][w] = len(proof) + width
+
                         else:
                             wiringR[level-1][w] = len(batch[level])
-                            wiringL[level-1][w] = 0
-                else:
-                    # sibling from proof
-                    stats2[level] = stats2[level] + 1
-                    proof.append(sv)
-                    if k[-1] == '0':
-                        wiringL[level-1][w] = len(batch[level])
-                        wiringR[level-1][w] = len(proof) + width
-
-                    else:
-                        wiringR[level-1][w] = len(batch[level])
-                        wiringL[level-1][w] = len(proof) + width
-                parent = k[:-1]
-                bm[level-1].append(parent)
+                            wiringL[level-1][w] = len(proof) + width
+                i += 1
+                w += 1
+            stats[level-1] = w  # number includes zeroth cell
 
+        self.witness_usage = {'cells': stats, 'proof': stats2}
         print("Proof usage:", stats2, file=sys.stderr)
-        print("Cell  usage:", stats, "Inputs:", len(batch[self.depth]), "Proof:", len(proof), file=sys.stderr)
+        print("Cell  usage:", stats, "Inputs:", len(batch[self.depth]),
+              "Proof:", [len(p) for p in segments] if groups else len(segments[0]), file=sys.stderr)
 
+        proof = segments if groups else segments[0]
         return (batch[self.depth], proof, wiringL, wiringR)
 
 
+def stage_batch(smt, keys, values, width):
+    # Inserts the batch into an overlay on top of smt.nodes, computes the proof and,
+    # if width is given, the witness. Only reads smt. old_root is the root the overlay
+    # was staged against.
+    if len(set(keys)) != len(keys):
+        raise ValueError("Duplicate keys in batch")
+    for key in keys:
+        if smt.has_leaf(key):
+            raise ValueError(f"The leaf '{smt.key_to_bits(key)}' is already set")
+    old_root = smt.get_root()
+    tree = copy.copy(smt)
+    tree.nodes = ChainMap({}, smt.nodes)
+    tree.leaf_pending = []
+    proof = tree.batch_insert(keys, values)
+    witness = tree.prepare_witness(proof, keys, values, width) if width is not None else None
+    return {'overlay': tree.nodes.maps[0], 'proof': proof, 'old_root': old_root, 'new_root': tree.get_root(),
+            'witness': witness}
+
+
+class StagedBatch:
+    # A batch staged against the current root of a tree, the tree is not modified.
+    # Fails as a whole (ValueError for duplicate leaves, OverflowError from the witness)
+    # before anything is committed. commit() applies the overlay of new nodes, if the
+    # tree is still at the root the batch was staged against; discard() drops it.
+    commit_lock = threading.Lock()
+
+    def __init__(self, smt, keys, values, width=None, staged=None):
+        self.smt = smt
+        self.keys = list(keys)
+        self.values = list(values)
+        if staged is None:
+            staged = stage_batch(smt, self.keys, self.values, width)
+        self.old_root = staged['old_root']
+        self.overlay = staged['overlay']
+        self.proof = staged['proof']
+        self.new_root = staged['new_root']
+        self.witness = staged['witness']
+
+    def commit(self):
+        if self.overlay is None:
+            raise ValueError("Staged batch was already committed or discarded")
+        with StagedBatch.commit_lock:
+            if self.smt.get_root() != self.old_root:
+                raise ValueError(f"Tree moved on from root {self.old_root}, stage the batch again")
+            self.smt.nodes.update(self.overlay)
+            self.smt.leaf_pending.extend(self.keys)
+        self.overlay = None
+        return self.proof
+
+    def discard(self):
+        self.overlay = None
+
+
+speculative_base = None
+
+def stage_speculative(args):
+    keys, values, width = args
+    try:
+        return stage_batch(speculative_base, keys, values, width)
+    except (ValueError, OverflowError) as e:
+        return e
+
+def speculate(smt, candidates, width=None, workers=None):
+    # Stages every candidate batch [(keys, values), ...] against the same base tree in
+    # forked workers, which inherit the base without copying it. Returns a StagedBatch
+    # or the exception raised while staging, for every candidate.
+    # imported here, they would double the import time of this module
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+    global speculative_base
+    speculative_base = smt
+    ctx = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(workers, mp_context=ctx) as pool:
+        results = list(pool.map(stage_speculative, [(keys, values, width) for keys, values in candidates]))
+    speculative_base = None
+    return [r if isinstance(r, Exception) else StagedBatch(smt, keys, values, staged=r)
+            for r, (keys, values) in zip(results, candidates)]
+
+
+class OpenRound:
+    # A batch collected key by key while the round is open. Every admit() adds the
+    # new part of the key's path to the affected prefixes and updates the proof
+    # positions: siblings of affected prefixes which are not affected themselves.
+    # close() then only reads the sibling values and inserts the batch, its cost does
+    # not depend on how long the round was open. The result is the same as
+    # batch_insert(keys, values).
+    # With a KeyFilter over the committed keys, admit() asks the filter instead of the
+    # node store, and close() adds the batch to the filter.
+    def __init__(self, smt, keyfilter=None):
+        self.smt = smt
+        self.keyfilter = keyfilter
+        self.keys = []
+        self.values = []
+        self.affected = {''}
+        self.siblings = set()
+
+    def admit(self, key, value):
+        path = self.smt.key_to_bits(key)
+        committed = not self.keyfilter.admit(key) if self.keyfilter else self.smt.has_leaf(key)
+        if path in self.affected or committed:
+            print(f"The leaf '{path}' is already set, skipping.", file=sys.stderr)
+            return False
+        self.keys.append(key)
+        self.values.append(value)
+        # from the leaf up to the first prefix already on the path of an admitted key
+        n = len(path)
+        while path[:n] not in self.affected:
+            p = path[:n]
+            self.affected.add(p)
+            self.siblings.discard(p)
+            sibling = p[:-1] + ('1' if p[-1] == '0' else '0')
+            if sibling not in self.affected:
+                self.siblings.add(sibling)
+            n -= 1
+        return True
+
+    def close(self):
+        smt = self.smt
+        for key in self.keys:
+            if smt.has_leaf(key):
+                raise ValueError(f"The leaf '{smt.key_to_bits(key)}' was set while the round was open")
+        proof = {}
+        for k in self.siblings:
+            v = smt.get_node(smt.depth - len(k), k)
+            if v != default:
+                proof[k] = v
+        for key, value in zip(self.keys, self.values):
+            smt.insert(key, value)
+        if self.keyfilter:
+            self.keyfilter.commit(self.keys)
+        return proof
+
+
 def main():
-    depth = 32
-    width = 20
+    parser = argparse.ArgumentParser(description="Generate input.json for ndproof.circom")
+    parser.add_argument('--depth', type=int, default=32)
+    parser.add_argument('--width', type=int, default=20)
+    parser.add_argument('--fill', type=int, default=32, help="leaves inserted before the proven batch")
+    parser.add_argument('--batch', type=int, default=None, help="size of the proven batch, defaults to width")
+    parser.add_argument('--proof', type=int, default=None,
+                        help="length M of the proof vector of NdVerifier(DEPTH, WIDTH, M), defaults to depth")
+    parser.add_argument('--groups', type=int, default=0,
+                        help="split the proof into GROUPS segments of interleaved layers, for ndproof_split.circom")
+    parser.add_argument('--segment', type=int, default=None, help="elements per proof segment, defaults to depth")
+    parser.add_argument('--split', type=int, default=0,
+                        help="partition the proof by the top SPLIT key bits; writes input_<prefix>.json for every "
+                             "touched subtree (ndproof.circom with DEPTH = depth - SPLIT) and top.json")
+    args = parser.parse_args()
+    depth = args.depth
+    width = args.width
 
     def to_int(aa):
         if isinstance(aa, (list, tuple)):
@@ -360,7 +718,7 @@ def main():
     # values = [b'value3', b'value0a', b'value0b', b'value0c']
     keys = []
     values = []
-    for i in range(32):
+    for i in range(args.fill):
         ri = random.randint(0, 2**depth-1)
         if ri in keys:
             break
@@ -370,23 +728,55 @@ def main():
     proof = smt.batch_insert(keys, values)
     new_root = smt.get_root()
 
+    # range [1, 6) holds the first three leaves, the pre-fill is mostly outside
+    leaves = list(smt.leaves(1, 6))
+    proof = smt.range_proof(1, 6)
+    assert {1, 2, 5} <= {k for k, _ in leaves}
+    assert smt.verify_range(1, 6, leaves, proof, new_root)
+    assert not smt.verify_range(1, 6, leaves[:1] + leaves[2:], proof, new_root)     # withheld leaf
+    assert not smt.verify_range(1, 6, [(leaves[0][0], leaves[0][1] + 1)] + leaves[1:], proof, new_root)
+    if proof:
+        k = next(iter(proof))
+        assert not smt.verify_range(1, 6, leaves, {**proof, k: proof[k] + 1}, new_root)
+
     keys = []
     values = []
-    for i in range(20):
+    for i in range(args.batch or width):
         ri = random.randint(0, 2**depth-1)
         p = smt.key_to_bits(ri)
         if ri in keys:
             break
+        if smt.has_leaf(ri):
+            continue
         keys.append(ri)
         values.append(to_int(("Val " + str(ri)).encode()))
 
     proof = smt.batch_insert(keys, values)
     new_new_root = smt.get_root()
     assert smt.verify_non_deletion(proof, new_root, new_new_root, keys, values)
-    batch, proof, wiringL, wiringR = smt.prepare_witness(proof, keys, values, width)
+    if args.split:
+        top, subs = smt.partition_proof(proof, keys, values, args.split)
+        assert smt.verify_partitioned(top, subs, new_root, new_new_root)
+        subdepth = depth - args.split
+        for sub, (batch, subproof, wiringL, wiringR) in zip(subs, smt.prepare_partitioned_witness(subs, width)):
+            with open(f"input_{sub['prefix']}.json", 'w') as f:
+                f.write(jdump({'batch': pad(batch, width), 'proof': pad(subproof, args.proof or subdepth),
+                               'controlL': wiringL, 'controlR': wiringR,
+                               'root1': js(sub['old_root']), 'root2': js(sub['new_root'])}))
+        with open('top.json', 'w') as f:
+            f.write(jdump({**top, 'root1': new_root, 'root2': new_new_root}))
+        return
+
+    if args.groups:
+        segment = args.segment or depth
+        batch, proof, wiringL, wiringR = smt.prepare_witness(proof, keys, values, width, args.groups, segment)
+        proof = [pad(p, segment) for p in proof]
+    else:
+        batch, proof, wiringL, wiringR = smt.prepare_witness(proof, keys, values, width)
+        proof = pad(proof, args.proof or depth)
 
     # witness formatted as json
-    jsond = jdump({'batch': pad(batch, width), 'proof': pad(proof, depth),
+    jsond = jdump({'batch': pad(batch, width), 'proof': proof,
                            'controlL': wiringL, 'controlR': wiringR,
                            'root1': js(new_root), 'root2': js(new_new_root)})
     print(jsond)
@@ -0,0 +1,75 @@
+np = None  # imported on first use, NumPy import dominates cold start
+
+# Structural plan of a batch: for every level, which nodes lie on the paths of the
+# batch, which of them pair up with their sibling, and which siblings are needed from
+# the proof. Hashing is left to the caller.
+#
+# Level 0 holds the leaves (the keys themselves), level 'depth' the root. Node x at
+# level l is the ancestor key >> l; its sibling is x ^ 1.
+#
+# For depth <= 64 all levels are computed at once from a (depth, batch) uint64 matrix
+# of shifted keys. Without NumPy, or for deeper trees, the same plan is built from
+# Python sets.
+
+
+class Plan:
+    def __init__(self, depth):
+        self.depth = depth
+        self.nodes = [[] for _ in range(depth + 1)]     # sorted unique nodes per level
+        self.pair = [[] for _ in range(depth)]          # nodes[l][i] is left, its sibling is nodes[l][i+1]
+        self.siblings = [[] for _ in range(depth)]      # sorted siblings of lone nodes, needed from proof
+
+
+def plan_batch(keys, depth):
+    # keys: unique integers below 2^depth
+    keys = sorted(keys)
+    if depth <= 64 and keys and load_numpy():
+        return plan_numpy(keys, depth)
+    return plan_python(keys, depth)
+
+
+def load_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            np = False
+    return np
+
+
+def plan_numpy(keys, depth):
+    plan = Plan(depth)
+    k = np.array(keys, dtype=np.uint64)
+    # shifted[l] are the ancestors at level l, sorted as the keys are
+    shifted = k[None, :] >> np.arange(depth, dtype=np.uint64)[:, None]
+    first = np.ones(shifted.shape, dtype=bool)
+    first[:, 1:] = shifted[:, 1:] != shifted[:, :-1]
+
+    for level in range(depth):
+        nodes = shifted[level][first[level]]
+        left = (nodes & np.uint64(1)) == 0
+        right_next = np.zeros(len(nodes), dtype=bool)
+        right_next[:-1] = nodes[1:] == nodes[:-1] + np.uint64(1)
+        pair = left & right_next
+        paired = pair.copy()
+        paired[1:] |= pair[:-1]
+        plan.nodes[level] = nodes.tolist()
+        plan.pair[level] = pair.tolist()
+        plan.siblings[level] = (nodes[~paired] ^ np.uint64(1)).tolist()
+    plan.nodes[depth] = [0]
+    return plan
+
+
+def plan_python(keys, depth):
+    plan = Plan(depth)
+    nodes = keys
+    for level in range(depth):
+        present = set(nodes)
+        plan.nodes[level] = nodes
+        plan.pair[level] = [x & 1 == 0 and x + 1 in present for x in nodes]
+        plan.siblings[level] = [x ^ 1 for x in nodes if x ^ 1 not in present]
+        nodes = sorted({x >> 1 for x in nodes})
+    plan.nodes[depth] = nodes if nodes else [0]
+    return plan
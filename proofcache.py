@@ -0,0 +1,111 @@
+from collections import OrderedDict
+import random
+
+# LRU cache of inclusion proofs in front of SparseMerkleTree.generate_inclusion_proof,
+# keyed by (root, key).
+#
+# A committed round changes only the nodes on the paths of its batch. A cached proof
+# for the previous root stays valid for the new root except for the siblings that lie
+# on those paths, so on commit these siblings are re-read from the tree and the entry
+# is moved to the new root. Entries of any other root are evicted.
+#
+# Sibling at level l of key x is the node (l, (x >> l) ^ 1); it is dirty, if some key
+# b in the batch has b >> l == (x >> l) ^ 1.
+#
+# Only rounds committed through batch_insert() (or reported with commit()) carry the
+# cache over. Commits that bypass it, OpenRound.close(), StagedBatch.commit() or
+# insert(), move the tree to a root the cache does not know: the next commit() then
+# evicts every entry, and proofs are generated afresh.
+
+
+class ProofCache:
+    def __init__(self, smt, capacity=4096):
+        self.smt = smt
+        self.capacity = capacity
+        self.entries = OrderedDict()    # (root, key) -> proof, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.patched = 0                # entries carried over with refreshed siblings
+        self.carried = 0                # entries carried over as they were
+        self.evictions = 0
+
+    def generate_inclusion_proof(self, key):
+        k = (self.smt.get_root(), key)
+        proof = self.entries.get(k)
+        if proof is not None:
+            self.hits += 1
+            self.entries.move_to_end(k)
+        else:
+            self.misses += 1
+            proof = self.smt.generate_inclusion_proof(key)
+            self.entries[k] = proof
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return list(proof)
+
+    def batch_insert(self, keys, values):
+        # commits a round through the cache
+        old_root = self.smt.get_root()
+        proof = self.smt.batch_insert(keys, values)
+        self.commit(old_root, self.smt.get_root(), keys)
+        return proof
+
+    def commit(self, old_root, new_root, keys):
+        depth = self.smt.depth
+        dirty = [{key >> level for key in keys} for level in range(depth)]
+
+        entries = OrderedDict()
+        for (root, key), proof in self.entries.items():
+            if root != old_root:
+                self.evictions += 1
+                continue
+            patched = False
+            for level in range(depth):
+                sibling = (key >> level) ^ 1
+                if sibling in dirty[level]:
+                    proof[level] = self.smt.get_node(level, format(sibling, '0{}b'.format(depth - level)))
+                    patched = True
+            if patched:
+                self.patched += 1
+            else:
+                self.carried += 1
+            entries[(new_root, key)] = proof
+        self.entries = entries
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'patched': self.patched, 'carried': self.carried, 'evictions': self.evictions}
+
+
+def main():
+    from ndsmt import SparseMerkleTree
+
+    depth = 32
+    smt = SparseMerkleTree(depth, 'blake2s')
+    cache = ProofCache(smt)
+    keys = random.sample(range(2**depth), 300)
+    cache.batch_insert(keys[:200], [k + 1 for k in keys[:200]])
+    for key in keys[:100]:
+        cache.generate_inclusion_proof(key)
+
+    # neighbours of cached keys, so that some siblings are dirty
+    batch = [key ^ 1 for key in keys[:20]] + keys[200:]
+    for _ in range(3):
+        cache.batch_insert(batch, [k + 1 for k in batch])
+        for key in keys[:100]:
+            assert cache.generate_inclusion_proof(key) == smt.generate_inclusion_proof(key)
+        batch = [k for k in random.sample(range(2**depth), 50) if not smt.has_leaf(k)]
+    assert cache.patched > 0 and cache.hits == 300 and cache.evictions == 0
+
+    # a commit bypassing the cache drops it on the next commit
+    smt.insert(batch[0], 1)
+    cache.batch_insert(batch[1:], [1] * (len(batch) - 1))
+    assert not cache.entries and cache.evictions == 100
+    print(f"okay, {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import argparse
+import itertools
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+# Proving-cost sweep over a grid of depth, batch size and tree fill.
+#
+# For every grid point an input is generated with the backend's own generator, the
+# commands are run, and their output is parsed into one JSON record per line: Cairo
+# resource usage (--print-resource-usage) and circom/snarkjs constraint counts, plus
+# wall times and input sizes. The default commands execute the Cairo verifier and
+# compile the circuit, they do not prove: command_seconds is the time of whatever
+# --prover commands were given, e.g. 'scarb prove --execute ...' or
+# 'snarkjs groth16 prove ...' for proving times.
+#
+# Command templates are formatted with {input} (generated input.json), {args} (Cairo
+# serde arguments), {executable} (Cairo executable of the proof format), {circuit}
+# (circom circuit with the grid's dimensions), {root} (this directory) and {workdir}.
+# --stub runs a fake prover, which prints the same kind of output computed from the
+# input size, to test the pipeline without the toolchains.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CAIRO = os.path.join(ROOT, 'cairo2-smt')
+
+BACKENDS = {
+    'cairo': {
+        'cwd': CAIRO,
+        'generate': [sys.executable, 'smt.py', '--depth', '{depth}', '--fill', '{fill}', '--batch', '{batch}'],
+        # expects a prior 'scarb build'
+        'commands': ["scarb execute --no-build --target standalone --package zk_verifier "
+                     "--executable-name {executable} --print-resource-usage --arguments-file {args}"],
+    },
+    'circom': {
+        'cwd': ROOT,
+        'generate': [sys.executable, 'ndsmt.py', '--depth', '{depth}', '--width', '{width}',
+                     '--proof', '{proof}', '--fill', '{fill}', '--batch', '{batch}'],
+        'commands': ["circom {circuit} --O2 --r1cs -l {root} -o {workdir}"],
+    },
+}
+
+PATTERNS = {
+    'steps': r'\bsteps:\s*(\d+)',
+    'memory_holes': r'memory holes:\s*(\d+)',
+    'nonlinear_constraints': r'non-linear constraints:\s*(\d+)',
+    'linear_constraints': r'(?<!non-)linear constraints:\s*(\d+)',
+    'constraints': r'# of Constraints:\s*(\d+)',
+    'wires': r'\bwires:\s*(\d+)',
+}
+
+
+def parse_usage(text):
+    record = {}
+    for name, pattern in PATTERNS.items():
+        m = re.search(pattern, text)
+        if m:
+            record[name] = int(m.group(1))
+    # builtins: ([RangeCheck: 9, Poseidon: 10]) or ("range_check_builtin": 9, ...)
+    m = re.search(r'builtins:\s*(.*)', text)
+    if m:
+        record['builtins'] = {k: int(v) for k, v in re.findall(r'"?([A-Za-z_]+)"?\s*:\s*(\d+)', m.group(1))}
+    return record
+
+
+def stub(backend, fn):
+    # fake prover output, scaled by the number of hashes a verifier would do
+    with open(fn) as f:
+        d = json.load(f)
+    if backend == 'cairo':
+        hashes = 2 * d['depth'] * len(d['batch'])
+        if d.get('format') == 'positional':
+            proof = len(d['proof']['mask']) + len(d['proof']['values'])
+        else:
+            proof = sum(2 * len(p) for p in d['proof'])
+        print("Resources:")
+        print(f"\tsteps: {40 * hashes + proof}")
+        print("\tmemory holes: 0")
+        print(f"\tbuiltins: ([RangeCheck: {2 * hashes}, Poseidon: {hashes}])")
+    else:
+        depth, width = len(d['controlL']), len(d['batch'])
+        cells = 2 * sum(min(1 << r, width) for r in range(depth))
+        print(f"non-linear constraints: {cells * (250 + 4 * (width + len(d['proof']) + 1))}")
+        print(f"linear constraints: {cells}")
+        print(f"wires: {cells * (width + len(d['proof']) + 260)}")
+
+
+def circuit(workdir, depth, width, proof):
+    # ndproof.circom with the grid's dimensions
+    with open(os.path.join(ROOT, 'ndproof.circom')) as f:
+        src = f.read()
+    src = re.sub(r'NdVerifier\(\d+,\s*\d+,\s*\d+\);', f'NdVerifier({depth}, {width}, {proof});', src)
+    fn = os.path.join(workdir, f'ndproof_{depth}_{width}_{proof}.circom')
+    with open(fn, 'w') as f:
+        f.write(src)
+    return fn
+
+
+def run(cmd, cwd):
+    start = time.time()
+    result = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True)
+    return result, time.time() - start
+
+
+def measure(backend, point, commands, workdir):
+    cfg = BACKENDS[backend]
+    record = {'backend': backend, **point}
+    fmt = {**point, 'root': ROOT, 'workdir': workdir,
+           'input': os.path.join(workdir, 'input.json'), 'args': os.path.join(workdir, 'args.json')}
+
+    generate = [a.format(**fmt) for a in cfg['generate']]
+    if point.get('format') == 'positional':
+        generate.append('--positional')
+    result, record['generate_seconds'] = run(generate, cfg['cwd'])
+    if result.returncode != 0:
+        record['error'] = f"generator failed: {result.stderr.strip().splitlines()[-1:]}"
+        return record
+    with open(fmt['input'], 'w') as f:
+        f.write(result.stdout)
+    record['input_bytes'] = len(result.stdout)
+
+    if backend == 'cairo':
+        result, _ = run([sys.executable, 'run_verifier.py', fmt['input'], '--serde', fmt['args']], CAIRO)
+        if result.returncode != 0:
+            record['error'] = f"serde conversion failed: {result.stderr.strip().splitlines()[-1:]}"
+            return record
+        with open(fmt['args']) as f:
+            record['serde_felts'] = len(json.load(f))
+        fmt['executable'] = 'main_positional' if point.get('format') == 'positional' else 'main'
+    else:
+        fmt['circuit'] = circuit(workdir, point['depth'], point['width'], point['proof'])
+
+    record['command_seconds'] = 0.0
+    for template in commands:
+        cmd = [a.format(**fmt) for a in shlex.split(template)]
+        try:
+            result, seconds = run(cmd, cfg['cwd'])
+        except OSError as e:
+            record['error'] = f"'{template}' failed: {e}"
+            break
+        record['command_seconds'] += seconds
+        record.update(parse_usage(result.stdout + result.stderr))
+        if result.returncode != 0:
+            record['error'] = f"'{template}' exited with {result.returncode}"
+            break
+    return record
+
+
+def ints(s):
+    return [int(x) for x in s.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep proving cost over a parameter grid")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='cairo')
+    parser.add_argument('--depth', type=ints, default=[32])
+    parser.add_argument('--batch', type=ints, default=[10, 100, 1000])
+    parser.add_argument('--fill', type=ints, default=[0, 1000])
+    parser.add_argument('--width', type=ints, default=None, help="circom: circuit widths, defaults to batch")
+    parser.add_argument('--proof', type=ints, default=None, help="circom: proof lengths M, defaults to depth")
+    parser.add_argument('--format', type=lambda s: s.split(','), default=['keyed'],
+                        help="cairo: proof encodings, keyed and/or positional")
+    parser.add_argument('--prover', action='append', help="command template, repeatable; replaces the defaults (which do not prove)")
+    parser.add_argument('--stub', action='store_true', help="fake prover, for testing the pipeline")
+    parser.add_argument('--out', help="JSON lines output, default stdout")
+    parser.add_argument('--stub-prover', nargs=2, metavar=('BACKEND', 'INPUT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stub_prover:
+        stub(*args.stub_prover)
+        return
+
+    commands = args.prover or BACKENDS[args.backend]['commands']
+    if args.stub:
+        commands = [f"{shlex.quote(sys.executable)} {shlex.quote(os.path.abspath(__file__))} "
+                    f"--stub-prover {args.backend} {{input}}"]
+
+    out = open(args.out, 'w') if args.out else sys.stdout
+    for depth, batch, fill in itertools.product(args.depth, args.batch, args.fill):
+        variants = [{'width': w, 'proof': m} for w in args.width or [batch] for m in args.proof or [depth]] \
+            if args.backend == 'circom' else [{'format': f} for f in args.format]
+        for variant in variants:
+            point = {'depth': depth, 'batch': batch, 'fill': fill, **variant}
+            print(f"Measuring {point}", file=sys.stderr)
+            with tempfile.TemporaryDirectory() as workdir:
+                record = measure(args.backend, point, commands, workdir)
+            print(json.dumps(record), file=out, flush=True)
+    if args.out:
+        out.close()
+
+
+if __name__ == "__main__":
+    main()
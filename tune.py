@@ -0,0 +1,125 @@
+from ndsmt import SparseMerkleTree
+import argparse
+import contextlib
+import io
+import json
+import random
+import sys
+
+# Circuit dimension autotuner for ndproof.circom.
+#
+# Batches are replayed through consistency proof and witness preparation, without
+# proving, to collect per-layer cell usage and proof length. Every candidate
+# (WIDTH, M) of NdVerifier(DEPTH, WIDTH, M) is then checked against the samples for
+# overflow, and its constraints estimated. DEPTH is given by the tree.
+#
+# Wiring row r (the control wires of layer r) has min(2^r, WIDTH) cells, row DEPTH-1
+# is the leaf layer. Every cell is a Cell(WIDTH, M): its muxes pick one of
+# 1 + WIDTH + M inputs, on every layer.
+
+# Rough constraint counts of the circomlib components used by ndproof.circom
+POSEIDON2 = 243             # Poseidon(2), 8 full and 57 partial rounds of x^5
+HASH2 = POSEIDON2 + 2 * 2 + 1 + 2   # + 2 * IsZero, bothZero, Mux
+
+def pick_one(n):
+    # Multiplexer(1, n): Decoder(n) and EscalarProduct(n)
+    return 2 * n + 1
+
+def cell(width, m):
+    return 2 * pick_one(1 + width + m) + HASH2
+
+def constraints(depth, width, m):
+    # two forest hashers (old and new root)
+    cells = sum(min(1 << r, width) for r in range(depth))
+    return 2 * cells * cell(width, m)
+
+
+def sample(smt, keys, values):
+    # one replayed batch: number of inputs, cells per wiring row, proof length
+    proof = smt.consistency_proof(keys)
+    with contextlib.redirect_stderr(io.StringIO()):
+        batch, proof, _, _ = smt.prepare_witness(proof, keys, values, len(keys))
+    return {'inputs': len(batch), 'cells': smt.witness_usage['cells'], 'proof': len(proof)}
+
+def replay(fn, depth, backend):
+    # recorded rounds, one JSON object per line: {"keys": [...], "values": [...]}
+    smt = SparseMerkleTree(depth, backend)
+    samples = []
+    with open(fn) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            r = json.loads(line)
+            keys = [int(k) for k in r['keys']]
+            values = [int(v) for v in r.get('values', [k + 1 for k in keys])]
+            samples.append(sample(smt, keys, values))
+            for key, value in zip(keys, values):
+                smt.insert(key, value)
+    return samples
+
+def synthetic(depth, fill, batch_size, count, backend):
+    # random batches against a tree pre-filled with 'fill' random leaves
+    smt = SparseMerkleTree(depth, backend)
+    for key in random.sample(range(2**depth), fill):
+        smt.insert(key, key + 1)
+    samples = []
+    for _ in range(count):
+        keys = [k for k in random.sample(range(2**depth), batch_size) if not smt.has_leaf(k)]
+        samples.append(sample(smt, keys, [k + 1 for k in keys]))
+    return samples
+
+
+def overflows(s, width, m):
+    return s['inputs'] > width or s['proof'] > m or max(s['cells']) > width
+
+def overflow_rate(samples, width, m):
+    return sum(overflows(s, width, m) for s in samples) / len(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recommend ndproof.circom dimensions from batch statistics")
+    parser.add_argument('--depth', type=int, default=32)
+    parser.add_argument('--record', help="recorded rounds, JSON lines with 'keys' and optional 'values'")
+    parser.add_argument('--fill', type=int, default=1000, help="synthetic: leaves in the tree")
+    parser.add_argument('--batch', type=int, default=20, help="synthetic: keys per batch")
+    parser.add_argument('--samples', type=int, default=100, help="synthetic: number of batches")
+    parser.add_argument('--widths', default="8,16,20,24,32,48,64")
+    parser.add_argument('--proofs', default="16,32,48,64,96,128,192,256,384,512",
+                        help="candidate proof lengths M")
+    parser.add_argument('--target', type=float, default=0.01, help="acceptable overflow rate")
+    parser.add_argument('--hash', default='blake2s',
+                        help="hash backend of the replayed tree; the witness shape does not depend on it")
+    args = parser.parse_args()
+
+    depth = args.depth
+    if args.record:
+        samples = replay(args.record, depth, args.hash)
+    else:
+        samples = synthetic(depth, args.fill, args.batch, args.samples, args.hash)
+    if not samples:
+        print("No batches to replay", file=sys.stderr)
+        exit(1)
+
+    print(f"{len(samples)} batches, inputs max {max(s['inputs'] for s in samples)}, "
+          f"proof max {max(s['proof'] for s in samples)}")
+    print(f"{'WIDTH':>6} {'M':>6} {'overflow':>9} {'constraints':>12}")
+    candidates = []
+    for w in [int(x) for x in args.widths.split(',')]:
+        for m in [int(x) for x in args.proofs.split(',')]:
+            rate = overflow_rate(samples, w, m)
+            cost = constraints(depth, w, m)
+            print(f"{w:>6} {m:>6} {rate:>9.4f} {cost:>12}")
+            if rate <= args.target:
+                candidates.append((cost, w, m, rate))
+
+    result = {'DEPTH': depth, 'target': args.target}
+    if candidates:
+        cost, w, m, rate = min(candidates)
+        result.update({'WIDTH': w, 'M': m, 'overflow': rate, 'constraints': cost})
+    else:
+        print("No (WIDTH, M) meets the target overflow rate", file=sys.stderr)
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()